@@ -1,15 +1,60 @@
 from ursina import *
 from ursina.shaders import lit_with_shadows_shader
+import argparse
+import functools
+import gc
+import hashlib
+import heapq
+import inspect
 import math
+import mmap
+import multiprocessing
+import os
 import random
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+import tracemalloc
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from panda3d.core import AudioManager, BitMask32, CollisionRay, Filename, Fog, GeomNode, LODNode, LVecBase4f, NodePath, OmniBoundingVolume, Point3, PStatClient, PStatCollector, PTA_LVecBase4f, SamplerState, TextureStage
+from panda3d.core import Texture as PandaTexture
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ----------- GAME SETUP -----------
-app = Ursina()
-window.title = 'B3313 1.0 - SPECIAL 64 EMULATOR'
-window.fps_counter.enabled = True
-window.exit_button.visible = False
-window.borderless = False
-window.fullscreen = False
+# Everything that needs the window lives under the __main__ guard at the bottom, so the
+# room generation pool can import this file in worker processes without opening a game.
+def setup_window():
+    window.title = 'B3313 1.0 - SPECIAL 64 EMULATOR'
+    window.fps_counter.enabled = True
+    window.exit_button.visible = False
+    window.borderless = False
+    window.fullscreen = False
+
+def destroy_entity(entity):
+    """ursina's destroy(), also dropping the python tag ursina puts on each entity's node.
+
+    destroy() never clears it, and the entity -> node -> tag -> entity cycle runs
+    through Panda3D, where the garbage collector can't follow it: every destroyed
+    entity stayed alive, with any animation's precomputed steps along with it.
+    """
+    def release(e):
+        if e.eternal:
+            return
+        for child in e.children:
+            release(child)
+        e.clear_python_tag('Entity')
+    if entity and entity is not camera:
+        release(entity)
+    destroy(entity)
 
 # ----------- B3313 GAME STATE & ASSETS -----------
 state = {
@@ -20,25 +65,1560 @@ state = {
     'game_mode': 'splash',  # 'splash', 'menu', 'game'
     'current_floor': 0,
     'personalization_level': 0,
-    'rooms_visited': [],
+    'rooms_visited': deque(maxlen=256),  # the most recent rooms only; a long run visits thousands
     'ai_watching': True,
 }
 
-# B3313 Ambient sounds
-try:
-    coin_sound = Audio('coin', loop=False, autoplay=False)
-    stomp_sound = Audio('hit', loop=False, autoplay=False)
-    star_sound = Audio('powerup', loop=False, autoplay=False)
-    jump_sound = Audio('jump', loop=False, autoplay=False)
-    ambient_hum = Audio('ambience', loop=True, autoplay=False, volume=0.3)
-    menu_hum = Audio('menu_hum', loop=True, autoplay=False, volume=0.2)
-except:
-    coin_sound = Audio('', loop=False, autoplay=False)
-    stomp_sound = Audio('', loop=False, autoplay=False)
-    star_sound = Audio('', loop=False, autoplay=False)
-    jump_sound = Audio('', loop=False, autoplay=False)
-    ambient_hum = Audio('', loop=False, autoplay=False)
-    menu_hum = Audio('', loop=False, autoplay=False)
+# B3313 Ambient sounds: name -> (clip, voices, priority, volume, loop)
+SOUND_MANIFEST = {
+    'star': ('powerup', 2, 2, 1, False),
+    'stomp': ('hit', 3, 1, 1, False),
+    'jump': ('jump', 2, 1, 1, False),
+    'coin': ('coin', 4, 0, 1, False),
+}
+SOUND_SUFFIXES = ['.ogg', '.wav', '.mp3']
+
+def find_sound_file(clip):
+    for folder in (application.asset_folder, getattr(application, 'internal_audio_folder', None)):
+        if folder is None:
+            continue
+        for suffix in SOUND_SUFFIXES:
+            path = os.path.join(str(folder), clip + suffix)
+            if os.path.exists(path):
+                return path
+    return None
+
+class NullVoice:
+    """Stands in for a voice when there is no audio device or the clip is missing"""
+    def play(self): pass
+    def stop(self): pass
+    def set_volume(self, volume): pass
+    def set_loop(self, loop): pass
+    def playing(self): return False
+
+class Voice:
+    def __init__(self, sound):
+        self.sound = sound
+    
+    def play(self): self.sound.play()
+    def stop(self): self.sound.stop()
+    def set_volume(self, volume): self.sound.set_volume(volume)
+    def set_loop(self, loop): self.sound.set_loop(loop)
+    def playing(self): return self.sound.status() == self.sound.PLAYING
+
+class SoundClip:
+    def __init__(self, name, voices, priority, volume, loop):
+        self.name = name
+        self.voices = voices
+        self.priority = priority
+        self.volume = volume
+        self.loop = loop
+        self.started = [0] * len(voices)
+        self.last_trigger = -math.inf
+
+class AudioBank:
+    """Every sound, loaded once, played through a few voices per clip.
+
+    Voices of one clip share Panda3D's decoded sample data, so a coin burst
+    overlaps instead of restarting one sound. Triggers of the same clip within
+    `dedupe_window` collapse into one, and past `max_voices` the oldest voice
+    of the lowest priority is stolen, or the new sound is dropped.
+    """
+    max_voices = 12
+    dedupe_window = 0.03
+    
+    def __init__(self):
+        self.clips = {}
+        self.null = False
+    
+    @property
+    def manager(self):
+        """The Panda3D sound effects manager, or None when running silent"""
+        try:
+            managers = base.sfxManagerList
+        except NameError:
+            # No ShowBase yet (offline tools)
+            return None
+        if self.null or not managers or not managers[0].is_valid():
+            return None
+        return managers[0]
+    
+    def load(self, name):
+        clip, voices, priority, volume, loop = SOUND_MANIFEST[name]
+        manager, path = self.manager, find_sound_file(clip)
+        if manager and path:
+            pool = [Voice(manager.get_sound(Filename.from_os_specific(path))) for i in range(voices)]
+        else:
+            pool = [NullVoice() for i in range(voices)]
+        for voice in pool:
+            voice.set_loop(loop)
+        self.clips[name] = SoundClip(name, pool, priority, volume, loop)
+    
+    def load_all(self, names=None):
+        for name in names or SOUND_MANIFEST:
+            self.load(name)
+    
+    def playing_voices(self):
+        return [(clip, i) for clip in self.clips.values() for i, voice in enumerate(clip.voices) if voice.playing()]
+    
+    def play(self, name, volume=1):
+        if name not in self.clips:
+            # Not preloaded yet (the splash was skipped, or an offline tool): load it on first use
+            if name not in SOUND_MANIFEST:
+                return
+            self.load(name)
+        clip = self.clips[name]
+        now = time.perf_counter()
+        if now - clip.last_trigger < self.dedupe_window:
+            return
+        clip.last_trigger = now
+        if clip.loop and any(voice.playing() for voice in clip.voices):
+            return
+        
+        free = [i for i, voice in enumerate(clip.voices) if not voice.playing()]
+        if free:
+            playing = self.playing_voices()
+            if len(playing) >= self.max_voices:
+                victims = [(c.priority, c.started[i], c, i) for c, i in playing if c.priority <= clip.priority]
+                if not victims:
+                    return
+                priority, started, victim, i = min(victims, key=lambda v: v[:2])
+                victim.voices[i].stop()
+            index = free[0]
+        else:
+            # Every voice of this clip is busy: restart the oldest one
+            index = min(range(len(clip.voices)), key=lambda i: clip.started[i])
+            clip.voices[index].stop()
+        voice = clip.voices[index]
+        voice.set_volume(clip.volume * volume)
+        voice.play()
+        clip.started[index] = now
+    
+    def stop(self, name):
+        clip = self.clips.get(name)
+        if clip:
+            for voice in clip.voices:
+                voice.stop()
+
+audio = AudioBank()
+
+# Positional emitters: kind -> (clip, voices, loop, audible radius, seconds between chirps, volume)
+EMITTER_MANIFEST = {
+    'goomba': ('goomba_step', 3, False, 25, (1.5, 4), 0.6),
+    'chain_chomp': ('chomp_bark', 2, False, 40, (2, 5), 0.9),
+    'fluorescent': ('fluorescent_hum', 3, True, 12, None, 0.3),
+    'door': ('door_hum', 2, True, 10, None, 0.2),
+}
+
+class Emitter:
+    __slots__ = ('anchor', 'kind', 'offset', 'room', 'radius', 'interval', 'next_chirp', 'voice')
+
+class PositionalAudio:
+    """3D sound emitters on enemies, lights and doors; only the closest few get voices.
+
+    Emitters are plain records, not Entities. Every `cull_interval` they are culled
+    against their audible radius and the `max_audible` closest take voices from
+    per-kind pools; every frame only those few are moved. Emitters in cached rooms
+    or out of range cost one distance check per cull and no voice.
+    """
+    max_audible = 8
+    cull_interval = 0.1
+    
+    def __init__(self):
+        self.emitters = []
+        self.audible = []
+        self.pools = {}
+        self.cull_timer = 0
+        self.driver = None
+    
+    def load(self, kind):
+        clip, voices, loop, radius, interval, volume = EMITTER_MANIFEST[kind]
+        manager, path = audio.manager, find_sound_file(clip)
+        if not manager or not path:
+            self.pools[kind] = None
+            return
+        pool = []
+        for i in range(voices):
+            sound = manager.get_sound(Filename.from_os_specific(path), True)
+            sound.set_loop(loop)
+            sound.set_volume(volume)
+            sound.set_3d_min_distance(2)
+            sound.set_3d_max_distance(radius)
+            pool.append(sound)
+        self.pools[kind] = pool
+    
+    def reset(self):
+        """Forget every emitter; call after a scene clear, which destroys the driver"""
+        for emitter in self.audible:
+            self.release(emitter)
+        self.emitters = []
+        self.audible = []
+        self.driver = Entity(name='positional_audio', update=self.update)
+    
+    def attach(self, anchor, kind, offset=(0, 0, 0), room=None):
+        """Make `anchor` (plus `offset`, in its space) a source of `kind`; silent kinds are never registered"""
+        if kind not in self.pools:
+            self.load(kind)
+        if not self.pools[kind]:
+            return None
+        clip, voices, loop, radius, interval, volume = EMITTER_MANIFEST[kind]
+        emitter = Emitter()
+        emitter.anchor, emitter.kind, emitter.room = anchor, kind, room
+        # ursina runs Panda3D y-up-left, so the offset needs no axis swap
+        emitter.offset = Point3(*offset)
+        emitter.radius, emitter.interval = radius, interval
+        emitter.next_chirp = random.uniform(*interval) if interval else 0
+        emitter.voice = None
+        self.emitters.append(emitter)
+        return emitter
+    
+    def world_position(self, emitter):
+        return render.get_relative_point(emitter.anchor, emitter.offset)
+    
+    def update(self):
+        if not self.emitters:
+            return
+        # The listener is the camera
+        listener = camera.get_pos(render)
+        quat = camera.get_quat(render)
+        forward, up = quat.get_forward(), quat.get_up()
+        audio.manager.audio_3d_set_listener_attributes(listener.x, listener.y, listener.z, 0, 0, 0,
+                                                       forward.x, forward.y, forward.z, up.x, up.y, up.z)
+        self.cull_timer -= time.dt
+        if self.cull_timer <= 0:
+            self.cull_timer = self.cull_interval
+            self.cull(listener)
+        
+        for emitter in self.audible:
+            position = self.world_position(emitter)
+            emitter.voice.set_3d_attributes(position.x, position.y, position.z, 0, 0, 0)
+            if emitter.interval:
+                emitter.next_chirp -= time.dt
+                if emitter.next_chirp <= 0:
+                    emitter.next_chirp = random.uniform(*emitter.interval)
+                    emitter.voice.play()
+    
+    def cull(self, listener):
+        live, in_range = [], []
+        for emitter in self.emitters:
+            if emitter.anchor.is_empty():
+                # Destroyed along with its enemy or room
+                self.release(emitter)
+                continue
+            live.append(emitter)
+            if emitter.room is not None and not emitter.room.enabled:
+                continue
+            distsq = (self.world_position(emitter) - listener).length_squared()
+            if distsq <= emitter.radius * emitter.radius:
+                in_range.append((distsq, emitter))
+        self.emitters = live
+        
+        closest = [emitter for distsq, emitter in heapq.nsmallest(self.max_audible, in_range, key=lambda c: c[0])]
+        for emitter in self.audible:
+            if emitter not in closest:
+                self.release(emitter)
+        for emitter in closest:
+            if emitter.voice is None:
+                self.acquire(emitter)
+        self.audible = [emitter for emitter in closest if emitter.voice is not None]
+    
+    def acquire(self, emitter):
+        pool = self.pools[emitter.kind]
+        if not pool:
+            return
+        emitter.voice = pool.pop()
+        position = self.world_position(emitter)
+        emitter.voice.set_3d_attributes(position.x, position.y, position.z, 0, 0, 0)
+        if not emitter.interval:
+            emitter.voice.play()
+    
+    def release(self, emitter):
+        if emitter.voice is None:
+            return
+        emitter.voice.stop()
+        self.pools[emitter.kind].append(emitter.voice)
+        emitter.voice = None
+
+positional_audio = PositionalAudio()
+
+# Ambience beds: name -> (clip, personalization level the layer fades in at, volume).
+# The menu bed has no level; it plays on the menu and splash only.
+AMBIENCE_LAYERS = {
+    'menu': ('menu_hum', None, 0.2),
+    'base': ('ambience', 0, 0.3),
+    'whispers': ('ambience_whispers', 3, 0.25),
+    'static': ('ambience_static', 6, 0.2),
+    'heartbeat': ('ambience_heartbeat', 10, 0.3),
+}
+
+class AmbienceLayer:
+    """One looping bed, opened in Panda3D's streaming mode: the file is decoded a few
+    small buffers ahead of playback, so memory stays flat however long the loop is"""
+    def __init__(self, name, clip, level, max_volume):
+        self.name = name
+        self.clip = clip
+        self.level = level
+        self.max_volume = max_volume
+        self.sound = None
+        self.target = 0
+        self._volume = 0
+    
+    @property
+    def volume(self):
+        return self._volume
+    
+    @volume.setter
+    def volume(self, value):
+        self._volume = value
+        if self.sound:
+            self.sound.set_volume(value * self.max_volume)
+    
+    def start(self):
+        if self.sound is None:
+            manager, path = audio.manager, find_sound_file(self.clip)
+            if not manager or not path:
+                return
+            self.sound = manager.get_sound(Filename.from_os_specific(path), False, AudioManager.SM_stream)
+            # Streams loop without a gap: the decoder seeks back before the buffers run dry
+            self.sound.set_loop(True)
+            self.volume = self._volume
+        if self.sound.status() != self.sound.PLAYING:
+            self.sound.play()
+    
+    def stop(self):
+        if self.sound:
+            self.sound.stop()
+
+class AmbienceMixer:
+    """Crossfades the ambience layers for the current scene and personalization level"""
+    fade_time = 2
+    
+    def __init__(self):
+        self.layers = [AmbienceLayer(name, *spec) for name, spec in AMBIENCE_LAYERS.items()]
+        self.scene = None
+        self.level = 0
+    
+    def enter(self, scene):
+        """Switch to the 'menu' or 'game' beds"""
+        self.scene = scene
+        self.level = state['personalization_level']
+        self.mix()
+    
+    def follow(self, level):
+        """Called every frame with the personalization level; only a change costs anything"""
+        if self.scene == 'game' and level != self.level:
+            self.level = level
+            self.mix()
+    
+    def wanted(self, layer):
+        if self.scene == 'menu':
+            return layer.level is None
+        return layer.level is not None and layer.level <= self.level
+    
+    def mix(self):
+        for layer in self.layers:
+            target = 1 if self.wanted(layer) else 0
+            if target == layer.target:
+                continue
+            layer.target = target
+            if target:
+                layer.start()
+            tweens.add(layer, 'volume', layer.volume, target, self.fade_time, curve=curve.in_out_sine,
+                       on_done=None if target else layer.stop)
+
+ambience = AmbienceMixer()
+
+# ----------- B3313 BAKED GEOMETRY CACHE -----------
+# Static geometry is baked from plain primitive copies (no Entities), flattened into a
+# handful of Geoms and written to disk in Panda3D's .bam format. Files are keyed by a
+# hash of the bake inputs plus the source of the bake functions, so editing a
+# generator invalidates its old files.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.b3313_cache')
+GEOMETRY_CACHE_VERSION = 1
+MENU_BACKGROUND_VARIANTS = 8
+
+# (model, position, scale, rotation, rgba, texture, texture_scale)
+BakePart = namedtuple('BakePart', 'model position scale rotation color texture texture_scale')
+
+def bake_parts(parts):
+    """Copy primitives for `parts` under one node and flatten them into as few Geoms as possible"""
+    root = NodePath('baked')
+    for part in parts:
+        model = load_model(part.model)
+        if model is None:
+            continue
+        piece = model.copy_to(root)
+        piece.set_pos(*part.position)
+        piece.set_scale(*part.scale)
+        # Same axis convention as Entity.rotation
+        piece.set_hpr(-part.rotation[1], -part.rotation[0], part.rotation[2])
+        piece.set_color_scale(Vec4(*part.color))
+        if part.texture:
+            texture = load_texture(part.texture)
+            if texture:
+                piece.set_texture(texture._texture, 1)
+                if part.texture_scale:
+                    piece.set_tex_scale(TextureStage.get_default(), *part.texture_scale)
+    # Transforms, colour scales and texture scales all end up in the vertex data
+    root.flatten_strong()
+    return root
+
+def _source_fingerprint(*sources):
+    """Hash of the source of every function in `sources`, and the repr of every other value"""
+    digest = hashlib.sha1(str(GEOMETRY_CACHE_VERSION).encode())
+    for source in sources:
+        if not callable(source):
+            digest.update(repr(source).encode())
+            continue
+        try:
+            digest.update(inspect.getsource(source).encode())
+        except (OSError, TypeError):
+            digest.update(source.__qualname__.encode())
+    return digest.hexdigest()
+
+class GeometryCache:
+    """On-disk cache of baked static subtrees"""
+    def __init__(self, folder=os.path.join(CACHE_DIR, 'geometry')):
+        self.folder = folder
+        self.enabled = True
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0}
+        self._fingerprints = {}
+    
+    def path_for(self, kind, inputs, builder):
+        if kind not in self._fingerprints:
+            # Everything a baked archetype is derived from, so editing any of it rebakes
+            self._fingerprints[kind] = _source_fingerprint(builder, bake_parts, room_shell_parts, menu_background_rolls,
+                                                           ROOM_SIZE, WALL_HEIGHT)
+        key = hashlib.sha1(f'{self._fingerprints[kind]}:{inputs!r}'.encode()).hexdigest()[:20]
+        return os.path.join(self.folder, f'{kind}-{key}.bam')
+    
+    def load(self, kind, inputs, builder):
+        """Return the baked node for (`kind`, `inputs`), calling builder(inputs) and writing it on a miss"""
+        if not self.enabled:
+            return builder(inputs)
+        path = self.path_for(kind, inputs, builder)
+        if os.path.exists(path):
+            try:
+                node = loader.loadModel(Filename.from_os_specific(path), noCache=True)
+                self.stats['hits'] += 1
+                return node
+            except (OSError, IOError) as e:
+                print(f"Geometry cache: could not load {path}: {e}")
+                self.stats['errors'] += 1
+        
+        self.stats['misses'] += 1
+        node = builder(inputs)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp_path = path + '.tmp'
+            if node.write_bam_file(Filename.from_os_specific(tmp_path)):
+                os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Geometry cache: could not write {path}: {e}")
+            self.stats['errors'] += 1
+        return node
+    
+    def clear(self):
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.endswith('.bam'):
+                    os.remove(os.path.join(self.folder, name))
+
+geometry_cache = GeometryCache()
+
+def room_shell_parts(inputs):
+    """Floor, walls and ceiling of a room archetype"""
+    room_type, has_ceiling = inputs
+    size, wall_height = ROOM_SIZE, WALL_HEIGHT
+    # Floor with different textures
+    floor_color = tuple(color.white if room_type == 'normal' else color.dark_gray)
+    wall_color = tuple(color.light_gray if room_type == 'normal' else color.black)
+    parts = [
+        BakePart('plane', (0, 0, 0), (size, size, size), (0, 0, 0), floor_color, 'white_cube', (10, 10)),
+        # North, south, east and west walls
+        BakePart('cube', (0, wall_height/2, size/2), (size, wall_height, 1), (0, 0, 0), wall_color, None, None),
+        BakePart('cube', (0, wall_height/2, -size/2), (size, wall_height, 1), (0, 0, 0), wall_color, None, None),
+        BakePart('cube', (size/2, wall_height/2, 0), (1, wall_height, size), (0, 0, 0), wall_color, None, None),
+        BakePart('cube', (-size/2, wall_height/2, 0), (1, wall_height, size), (0, 0, 0), wall_color, None, None),
+    ]
+    if has_ceiling:
+        parts.append(BakePart('plane', (0, wall_height, 0), (size, size, size), (180, 0, 0), wall_color, None, None))
+    return parts
+
+def bake_room_shell(inputs):
+    return bake_parts(room_shell_parts(inputs))
+
+def room_shell_colliders():
+    """(position, scale) of the invisible boxes standing in for the baked floor and walls"""
+    size, wall_height = ROOM_SIZE, WALL_HEIGHT
+    return [
+        ((0, -0.05, 0), (size, 0.1, size)),
+        ((0, wall_height/2, size/2), (size, wall_height, 1)),
+        ((0, wall_height/2, -size/2), (size, wall_height, 1)),
+        ((size/2, wall_height/2, 0), (1, wall_height, size)),
+        ((-size/2, wall_height/2, 0), (1, wall_height, size)),
+    ]
+
+def menu_background_rolls(variant):
+    """Roll one of the menu background variants: (void geometry, static stars, moving stars)"""
+    rng = random.Random(variant)
+    voids = []
+    # Dark void with more chaotic geometry
+    for i in range(50):
+        voids.append({
+            'model': rng.choice(['cube', 'sphere', 'cylinder']),
+            'color': rng.choice([color.black, color.dark_gray, color.red]),
+            'scale': rng.uniform(1, 7),
+            'position': (rng.uniform(-30, 30), rng.uniform(-20, 20), rng.uniform(-40, -10)),
+            'spin': rng.uniform(5, 20),
+            'pulse': rng.uniform(0.5, 1.5) if rng.random() < 0.4 else 0,
+        })
+    
+    # Corrupted stars with more glitches
+    static_stars, moving_stars = [], []
+    for i in range(30):
+        star_color = tuple(rng.choice([color.yellow, color.red, color.black, color.white, color.green]))
+        scale = rng.uniform(0.1, 0.4)
+        position = (rng.uniform(-20, 20), rng.uniform(-15, 15), rng.uniform(-30, -5))
+        # Glitchy movement
+        if rng.random() < 0.5:
+            moving_stars.append((star_color, scale, position, (rng.uniform(-8, 8), rng.uniform(-5, 5), 0)))
+        else:
+            static_stars.append(BakePart('cube', position, (scale, scale, scale), (0, 0, 0), star_color, None, None))
+    return voids, static_stars, moving_stars
+
+def bake_menu_stars(variant):
+    return bake_parts(menu_background_rolls(variant)[1])
+
+def prewarm_geometry_cache():
+    """Bake every cacheable archetype so the first menu and room visits are cache hits"""
+    started = time.perf_counter()
+    for room_type in ROOM_TYPES:
+        for has_ceiling in (True, False):
+            geometry_cache.load('room_shell', (room_type, has_ceiling), bake_room_shell)
+    for variant in range(MENU_BACKGROUND_VARIANTS):
+        geometry_cache.load('menu_stars', variant, bake_menu_stars)
+    s = geometry_cache.stats
+    print(f"Geometry cache prewarmed in {time.perf_counter() - started:.2f}s "
+          f"({s['misses']} baked, {s['hits']} already cached) in {geometry_cache.folder}")
+
+# ----------- B3313 GLITCH TEXT -----------
+class GlitchText(Entity):
+    """UI text that glitches between a fixed set of strings.
+
+    Each string is laid out once, as a child Text sharing the font's glyph page,
+    so assigning `.text` just enables a different child. Scale and position live
+    on this parent entity, and so does colour: the children stay white and `.color`
+    (and animate('color')) sets this entity's colour scale, which they inherit
+    without rebuilding their glyphs.
+    """
+    def __init__(self, variants, origin=(0, 0), **kwargs):
+        self.variants = {}
+        self._color = text_color = kwargs.pop('color', color.white)
+        super().__init__(parent=camera.ui, **kwargs)
+        # Entity's own setup assigns its default colour through the property; put ours back
+        self.color = text_color
+        self.text_origin = origin
+        self.current = None
+        self._text = None
+        for text in variants:
+            self.variant(text)
+        self.text = variants[0]
+    
+    def variant(self, text):
+        """The pre-built Text for `text`, laying it out the first time it is asked for"""
+        if text not in self.variants:
+            variant = Text(text, parent=self, origin=self.text_origin, color=color.white, enabled=False)
+            # Text switches colour scale inheritance off; let this entity's reach the glyphs
+            variant.clear_color_scale()
+            self.variants[text] = variant
+        return self.variants[text]
+    
+    @property
+    def color(self):
+        return self._color
+    
+    @color.setter
+    def color(self, value):
+        self._color = value
+        self.set_color_scale(value)
+    
+    @property
+    def text(self):
+        return self._text
+    
+    @text.setter
+    def text(self, value):
+        variant = self.variant(value)
+        if variant is self.current:
+            return
+        if self.current is not None:
+            self.current.enabled = False
+        variant.enabled = True
+        self.current = variant
+        self._text = value
+
+# ----------- B3313 HITCH WATCHDOG -----------
+# Always on. Code marks which phase of the frame is running; a watcher thread
+# samples the main thread's Python stack once a frame has overrun the threshold,
+# and the frame is logged to a ring buffer when it ends. 'h' dumps the buffer.
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+
+HitchEvent = namedtuple('HitchEvent', 'when frame_ms phase mode floor room_type stack')
+
+def game_context():
+    """(game mode, floor, room type) for tagging hitch reports and profiles"""
+    try:
+        room_type = current_room.room_type if state['game_mode'] == 'game' else None
+    except NameError:  # no level has been built yet
+        room_type = None
+    return state['game_mode'], state['current_floor'], room_type
+
+def frame_phase(name):
+    """Decorator marking every run of the function as frame phase `name`"""
+    def decorate(function):
+        @functools.wraps(function)
+        def marked(*args, **kwargs):
+            previous = frame_watchdog.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                frame_watchdog.leave(name, previous)
+        return marked
+    return decorate
+
+class FrameWatchdog:
+    """Logs frames slower than `threshold` seconds with the phase and Python stack that overran.
+
+    The per-frame cost on the main thread is two task callbacks and an attribute
+    write per marked phase; the stack walk happens on the watcher thread, and only
+    for frames that are already over budget.
+    """
+    threshold = 0.05
+    poll = 0.005
+    
+    def __init__(self, capacity=256):
+        self.events = deque(maxlen=capacity)
+        self.phase = 'engine'
+        self.frame = 0
+        self.frame_started = None
+        self.sample = None
+        self.main_thread = threading.get_ident()
+        self.thread = None
+        self.running = False
+    
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        base.taskMgr.add(self.frame_start, 'b3313_frame_start', sort=-100)
+        # Just ahead of igLoop, which culls and draws
+        base.taskMgr.add(self.render_start, 'b3313_render_start', sort=49)
+        self.thread = threading.Thread(target=self.watch, name='b3313_watchdog', daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.running = False
+        base.taskMgr.remove('b3313_frame_start')
+        base.taskMgr.remove('b3313_render_start')
+    
+    def enter(self, name):
+        if pstats_export.connected:
+            pstats_export.collector(name).start()
+        previous, self.phase = self.phase, name
+        return previous
+    
+    def leave(self, name, previous):
+        if pstats_export.connected:
+            pstats_export.collector(name).stop()
+        self.phase = previous
+    
+    def frame_start(self, task):
+        now = time.perf_counter()
+        if self.frame_started is not None and now - self.frame_started > self.threshold:
+            self.record(now - self.frame_started)
+        self.frame += 1
+        self.frame_started = now
+        self.phase = 'engine'
+        return task.cont
+    
+    def render_start(self, task):
+        self.phase = 'render'
+        return task.cont
+    
+    def watch(self):
+        while self.running:
+            time.sleep(self.poll)
+            started, frame = self.frame_started, self.frame
+            if started is None or time.perf_counter() - started < self.threshold:
+                continue
+            if self.sample is not None and self.sample[0] == frame:
+                continue
+            stack = sys._current_frames().get(self.main_thread)
+            text = ''.join(traceback.format_stack(stack, limit=40)) if stack is not None else ''
+            self.sample = (frame, self.phase, text)
+    
+    def record(self, duration):
+        sample = self.sample
+        if sample is not None and sample[0] == self.frame:
+            phase, stack = sample[1], sample[2]
+        else:
+            # The watcher didn't get the GIL during the frame: all we know is where it ended
+            phase, stack = self.phase, ''
+        mode, floor, room_type = game_context()
+        self.events.append(HitchEvent(datetime.now(), duration * 1000, phase, mode, floor, room_type, stack))
+    
+    def dump(self, folder=PROFILE_DIR):
+        """Write the buffered hitches to a timestamped file and return its path"""
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"hitches-{datetime.now():%Y%m%d-%H%M%S}.txt")
+        with open(path, 'w') as f:
+            f.write(f"{len(self.events)} frames over {self.threshold * 1000:.0f} ms\n")
+            for event in self.events:
+                f.write(f"\n{event.when:%H:%M:%S.%f} {event.frame_ms:.1f} ms in {event.phase} "
+                        f"(mode {event.mode}, floor {event.floor}, room {event.room_type})\n")
+                f.write(event.stack or '  no stack sample\n')
+        print(f"Wrote {len(self.events)} hitches to {path}")
+        return path
+
+frame_watchdog = FrameWatchdog()
+
+class SamplingProfiler:
+    """Statistical profiler for the running game; stacks are written in collapsed (flamegraph) form.
+
+    A thread samples the main thread every `interval` seconds. Each stack is
+    prefixed with the game mode, floor, room type and frame phase, so one
+    recording from a long session splits cleanly into those states.
+    """
+    interval = 0.001
+    
+    def __init__(self):
+        self.counts = Counter()
+        self.labels = {}
+        self.main_thread = threading.get_ident()
+        self.thread = None
+        self.running = False
+        self.started = None
+    
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+    
+    def start(self):
+        self.counts.clear()
+        self.running = True
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.sample_loop, name='b3313_profiler', daemon=True)
+        self.thread.start()
+        print(f"Profiling at {1 / self.interval:.0f} Hz; press F9 again to stop")
+    
+    def stop(self, folder=PROFILE_DIR):
+        """Stop sampling and write the collapsed stacks; returns the file's path"""
+        self.running = False
+        self.thread.join()
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded")
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        seconds = time.perf_counter() - self.started
+        print(f"Wrote {sum(self.counts.values())} samples over {seconds:.1f}s to {path}")
+        return path
+    
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+    
+    def sample_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.main_thread)
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            mode, floor, room_type = game_context()
+            tags = [mode, f"floor {floor}", room_type or 'no room', frame_watchdog.phase]
+            self.counts[';'.join(tags + stack[::-1])] += 1
+
+profiler = SamplingProfiler()
+
+# ----------- B3313 PSTATS -----------
+# With --pstats, every frame phase above also runs a PStats collector, so game
+# logic shows up next to Panda3D's own cull and draw times in the PStats viewer.
+PSTATS_PORT = 5185
+
+class PStatsExport:
+    """Game-side PStats collectors (one per frame phase) and scene gauges"""
+    gauge_every = 15
+    
+    def __init__(self):
+        self.connected = False
+        self.collectors = {}
+        self.gauges = {}
+        self.pending_invokes = 0
+        self.frame = 0
+    
+    def connect(self, address):
+        """Connect to a PStats server at 'host' or 'host:port'; returns whether it answered"""
+        host, _, port = address.partition(':')
+        self.connected = PStatClient.connect(host, int(port or PSTATS_PORT))
+        if not self.connected:
+            print(f"No PStats server at {host}:{port or PSTATS_PORT}")
+            return False
+        for name in ('Entities', 'Colliders', 'Pending invokes'):
+            self.gauges[name] = PStatCollector(f'B3313 scene:{name}')
+        base.taskMgr.add(self.update_gauges, 'b3313_pstats_gauges', sort=48)
+        return True
+    
+    def collector(self, phase):
+        collector = self.collectors.get(phase)
+        if collector is None:
+            collector = self.collectors[phase] = PStatCollector('B3313:' + phase.replace(' ', '_'))
+        return collector
+    
+    def update_gauges(self, task):
+        self.frame += 1
+        self.gauges['Pending invokes'].set_level(self.pending_invokes)
+        # Walking every entity for colliders isn't free; a few times a second is plenty
+        if self.frame % self.gauge_every == 0:
+            entities = scene.entities
+            self.gauges['Entities'].set_level(len(entities))
+            self.gauges['Colliders'].set_level(sum(1 for e in entities if e.collider))
+        return task.cont
+
+pstats_export = PStatsExport()
+
+ursina_invoke = invoke
+
+def invoke(function, *args, **kwargs):
+    """ursina's invoke, with the callback marked as the 'invoke' frame phase and counted while pending"""
+    marked = frame_phase('invoke')(function)
+    def run(*call_args, **call_kwargs):
+        pstats_export.pending_invokes -= 1
+        return marked(*call_args, **call_kwargs)
+    pstats_export.pending_invokes += 1
+    return ursina_invoke(run, *args, **kwargs)
+
+# ----------- B3313 TWEENS & MESSAGES -----------
+class Tween:
+    __slots__ = ('target', 'attr', 'start', 'end', 'duration', 'curve', 'elapsed', 'on_done')
+
+class TweenSystem:
+    """Every running tween, advanced from one update instead of an animation Sequence each"""
+    def __init__(self):
+        self.tweens = []
+        self.driver = None
+    
+    def reset(self):
+        """Drop running tweens; call after a scene clear, which destroys the driver"""
+        self.tweens = []
+        self.driver = Entity(name='tween_driver', update=self.update)
+    
+    def add(self, target, attr, start, end, duration, curve=curve.linear, delay=0, on_done=None):
+        if self.driver is None:
+            self.reset()
+        self.cancel(target, attr)
+        tween = Tween()
+        tween.target, tween.attr, tween.start, tween.end = target, attr, start, end
+        tween.duration, tween.curve, tween.elapsed, tween.on_done = duration, curve, -delay, on_done
+        self.tweens.append(tween)
+        return tween
+    
+    def cancel(self, target, attr=None):
+        self.tweens = [t for t in self.tweens if t.target is not target or (attr and t.attr != attr)]
+    
+    @frame_phase('tweens')
+    def update(self):
+        if not self.tweens:
+            return
+        running, finished = [], []
+        for tween in self.tweens:
+            tween.elapsed += time.dt
+            if tween.elapsed < 0:
+                running.append(tween)
+                continue
+            t = min(1, tween.elapsed / tween.duration) if tween.duration else 1
+            setattr(tween.target, tween.attr, lerp(tween.start, tween.end, tween.curve(t)))
+            (running if t < 1 else finished).append(tween)
+        self.tweens = running
+        for tween in finished:
+            if tween.on_done:
+                tween.on_done()
+
+tweens = TweenSystem()
+
+# channel: (priority, seconds before the channel may take another slot, coalesce repeats)
+MESSAGE_CHANNELS = {
+    'death': (3, 0, False),
+    'star': (3, 0, False),
+    'warp': (2, 0, False),
+    'damage': (2, 0.3, True),
+    'cursed': (1, 0.2, True),
+    'floor': (1, 1, False),
+}
+
+class MessageSlot(Text):
+    """One reusable line of on-screen text in the message pool"""
+    def __init__(self):
+        super().__init__('', parent=camera.ui, origin=(0, 0), color=color.white, enabled=False)
+        self.channel = None
+        self.priority = 0
+        self.message = ''
+        self.count = 0
+        self.started = 0
+        self._fade = 1
+    
+    @property
+    def fade(self):
+        return self._fade
+    
+    @fade.setter
+    def fade(self, value):
+        # Alpha scale only; Text.color would lay the glyphs out again
+        self._fade = value
+        self.set_alpha_scale(value)
+
+class MessageChannel:
+    """Fixed pool of on-screen messages with per-channel priority, rate limits and coalescing.
+
+    Replaces print_on_screen, which made a new Text per call. A burst of the same
+    text folds into one slot ("CURSED ×4"); when every slot is busy, the oldest
+    lower-priority message is taken over, and otherwise the new one is dropped.
+    """
+    pool_size = 6
+    
+    def __init__(self):
+        self.slots = []
+        self.last_post = {}
+    
+    def reset(self):
+        """Rebuild the pool; call after a scene clear, which destroys the old slots"""
+        self.slots = [MessageSlot() for i in range(self.pool_size)]
+        self.last_post = {}
+    
+    def live(self, channel):
+        return [slot for slot in self.slots if slot.enabled and slot.channel == channel]
+    
+    def post(self, text, channel, position=(0, 0), scale=2, duration=2, color=color.white):
+        if not self.slots:
+            self.reset()
+        priority, min_interval, coalesce = MESSAGE_CHANNELS[channel]
+        now = time.perf_counter()
+        live = self.live(channel)
+        
+        # Only an identical message folds in, so the count never mixes texts
+        same = [slot for slot in live if slot.message == text]
+        if coalesce and same:
+            self.show(max(same, key=lambda slot: slot.started), text, position, scale, duration, color, bump=True)
+            return
+        if live and now - self.last_post.get(channel, -math.inf) < min_interval:
+            return
+        
+        slot = next((slot for slot in self.slots if not slot.enabled), None)
+        if slot is None:
+            busy = [slot for slot in self.slots if slot.priority <= priority]
+            if not busy:
+                return
+            slot = min(busy, key=lambda slot: (slot.priority, slot.started))
+        slot.channel, slot.priority, slot.count = channel, priority, 0
+        self.last_post[channel] = now
+        self.show(slot, text, position, scale, duration, color)
+    
+    def show(self, slot, text, position, scale, duration, color, bump=False):
+        slot.count = slot.count + 1 if bump else 1
+        slot.message = text
+        slot.text = f'{text} ×{slot.count}' if slot.count > 1 else text
+        slot.position = position
+        slot.set_color_scale(color)
+        slot.fade = 1
+        slot.started = time.perf_counter()
+        slot.enabled = True
+        # Pop in, hold, fade out
+        tweens.add(slot, 'scale', scale * 1.3, scale, 0.15, curve=curve.out_expo)
+        tweens.add(slot, 'fade', 1, 0, min(0.3, duration), delay=max(0, duration - 0.3), on_done=lambda: self.hide(slot))
+    
+    def hide(self, slot):
+        slot.enabled = False
+        slot.channel = None
+
+messages = MessageChannel()
+
+# ----------- B3313 QUALITY GOVERNOR -----------
+QualityTier = namedtuple('QualityTier', 'name shadow_size decor far_clip')
+
+# Best first; a far_clip of None keeps the camera's default
+QUALITY_TIERS = [
+    QualityTier('high', 2048, 1.0, None),
+    QualityTier('medium', 1024, 0.6, 300),
+    QualityTier('low', 512, 0.35, 180),
+    QualityTier('minimal', 256, 0.15, 120),
+]
+
+class QualityGovernor:
+    """Moves between QUALITY_TIERS from a rolling window of measured frame times.
+
+    Steps down after `down_after` slow evaluations in a row and up after
+    `up_after` fast ones, with a cooldown after every change, so a single hitch
+    or a quiet moment doesn't make it flap. Every change is logged.
+    """
+    target_fps = 60
+    window = 120
+    evaluate_every = 1
+    slow = 1.15
+    fast = 0.7
+    down_after = 2
+    up_after = 5
+    cooldown = 3
+    
+    def __init__(self):
+        self.tier_index = 0
+        self.pinned = False
+        self.frame_times = deque(maxlen=self.window)
+        self.decor = []
+        self.sun = None
+        self.sky = None
+        self.default_far = None
+        self.driver = None
+        self.timer = 0
+        self.since_change = 0
+        self.slow_count = 0
+        self.fast_count = 0
+    
+    @property
+    def tier(self):
+        return QUALITY_TIERS[self.tier_index]
+    
+    def pin(self, name):
+        """Hold one tier for the whole session"""
+        self.tier_index = [tier.name for tier in QUALITY_TIERS].index(name)
+        self.pinned = True
+    
+    def reset(self):
+        """Start measuring afresh; call after a scene clear, which destroys the driver and decor"""
+        self.frame_times.clear()
+        self.decor = []
+        self.timer = self.slow_count = self.fast_count = 0
+        self.driver = Entity(name='quality_governor', update=self.update)
+        self.apply()
+    
+    def add_decor(self, entity):
+        """Register a purely decorative entity; lower tiers hide a share of them"""
+        self.decor.append(entity)
+        self.set_decor_active(len(self.decor) - 1)
+    
+    def set_decor_active(self, i):
+        entity = self.decor[i]
+        # Golden-ratio spread: any fraction keeps an even sample of the decor
+        active = (i * 0.618034) % 1 < self.tier.decor
+        if entity.is_empty() or entity.enabled == active:
+            return
+        entity.enabled = active
+        for animation in getattr(entity, 'animations', []):
+            if active:
+                animation.resume()
+            else:
+                animation.pause()
+    
+    def update(self):
+        self.frame_times.append(time.dt)
+        self.timer += time.dt
+        self.since_change += time.dt
+        if self.pinned or self.timer < self.evaluate_every or len(self.frame_times) < self.window // 2:
+            return
+        self.timer = 0
+        
+        p90 = sorted(self.frame_times)[int(len(self.frame_times) * 0.9)]
+        budget = 1 / self.target_fps
+        if p90 > budget * self.slow:
+            self.slow_count, self.fast_count = self.slow_count + 1, 0
+        elif p90 < budget * self.fast:
+            self.slow_count, self.fast_count = 0, self.fast_count + 1
+        else:
+            self.slow_count = self.fast_count = 0
+        
+        if self.since_change < self.cooldown:
+            return
+        if self.slow_count >= self.down_after and self.tier_index < len(QUALITY_TIERS) - 1:
+            self.change(1, p90)
+        elif self.fast_count >= self.up_after and self.tier_index > 0:
+            self.change(-1, p90)
+    
+    def change(self, step, p90):
+        old = self.tier
+        self.tier_index += step
+        self.slow_count = self.fast_count = 0
+        self.since_change = 0
+        self.frame_times.clear()
+        print(f"Quality: {old.name} -> {self.tier.name} "
+              f"(p90 frame {p90 * 1000:.1f} ms, target {1000 / self.target_fps:.1f} ms)")
+        self.apply()
+    
+    def apply(self):
+        tier = self.tier
+        if self.sun is not None and not self.sun.is_empty():
+            self.apply_shadow_size(tier.shadow_size)
+        self.apply_far()
+        for i in range(len(self.decor)):
+            self.set_decor_active(i)
+
+    def apply_shadow_size(self, size):
+        # ursina only reads shadow_map_resolution in its `shadows` setter; resize the caster directly
+        self.sun.shadow_map_resolution = (size, size)
+        self.sun._light.set_shadow_caster(True, size, size)
+        actual = self.sun._light.get_shadow_buffer_size()
+        if (actual.x, actual.y) != (size, size):
+            print(f"Quality: shadow buffer is {actual.x}x{actual.y}, expected {size}x{size}")
+    
+    def apply_far(self):
+        """Far plane: the tier's, pulled in further when the fog hides everything beyond it"""
+        if application.window_type == 'none':
+            return  # the headless soak has no camera lens
+        if self.default_far is None:
+            self.default_far = camera.clip_plane_far
+        camera.clip_plane_far = min(self.tier.far_clip or self.default_far, fog_culling.far)
+        if self.sky is not None:
+            # Keep the dome inside the far plane; it is drawn first without depth, so its size never shows
+            self.sky.scale = camera.clip_plane_far / 2
+
+governor = QualityGovernor()
+
+# ----------- B3313 FOG CULLING -----------
+# Exponential fog leaves exp(-density * d) of a surface's colour; below one 8-bit
+# step of that, the surface is indistinguishable from the fog colour.
+FOG_VISIBLE_LEVEL = 1 / 255
+
+def fog_extinction_distance(density):
+    """Distance beyond which fog of `density` (a float, or a linear (start, end) range) hides everything"""
+    if isinstance(density, tuple):
+        return density[1]
+    if not density:
+        return float('inf')
+    return math.log(1 / FOG_VISIBLE_LEVEL) / density
+
+class FogCulling:
+    """Follows scene.fog_density: the camera far plane and the logic-update radius track its extinction distance.
+
+    Thicker fog (deeper corruption) then means less to draw and less to
+    update, not only a darker picture. `radius` is the update scheduler's default
+    relevance radius.
+    """
+    # Logic keeps running a little past the visible edge, so nothing freezes in view
+    logic_margin = 10
+    
+    def __init__(self):
+        self.density = None
+        self.far = float('inf')
+        self.radius = float('inf')
+        self.radius_sq = float('inf')
+        self.driver = None
+    
+    def reset(self):
+        """Forget the previous scene's fog; call after a scene clear, which destroys the driver"""
+        self.density = None
+        self.far = self.radius = self.radius_sq = float('inf')
+        self.driver = Entity(name='fog_culling', update=self.update)
+    
+    def update(self):
+        density = scene.fog_density
+        if density == self.density:
+            return
+        self.density = density
+        self.far = fog_extinction_distance(density)
+        self.radius = self.far + self.logic_margin
+        self.radius_sq = self.radius ** 2
+        governor.apply_far()
+
+fog_culling = FogCulling()
+
+# ----------- B3313 UPDATE SCHEDULING -----------
+UpdatePolicy = namedtuple('UpdatePolicy', 'mode radius every', defaults=(None, 1))
+
+UPDATE_ALWAYS = UpdatePolicy('always')
+UPDATE_VISIBLE = UpdatePolicy('visible')
+
+def update_within(radius=None):
+    """Tick only within `radius` of the player; None follows the fog culling radius"""
+    return UpdatePolicy('radius', radius)
+
+def update_every(frames):
+    """Tick once every `frames` frames, staggered across entities"""
+    return UpdatePolicy('every', every=frames)
+
+# Longest dt handed to an entity catching up after being skipped
+MAX_CATCH_UP = 0.5
+
+class ScheduledUpdate:
+    __slots__ = ('entity', 'policy', 'phase', 'last')
+
+class UpdateScheduler:
+    """Ticks entities by their UpdatePolicy from one driver, instead of ursina calling every update().
+
+    Scheduled entities implement tick(dt) rather than update(). An entity that was
+    skipped gets the time it missed (up to MAX_CATCH_UP) on its next tick, so
+    patrols and timers pick up where they would have been.
+    """
+    def __init__(self):
+        self.entries = []
+        self.clock = 0
+        self.frame = 0
+        self.driver = None
+        self.stats = {'ticked': 0, 'skipped': 0}
+    
+    def reset(self):
+        """Drop scheduled entities; call after a scene clear, which destroys them and the driver"""
+        self.entries = []
+        self.driver = Entity(name='update_scheduler', update=self.update)
+    
+    def add(self, entity, policy=UPDATE_ALWAYS):
+        if self.driver is None:
+            self.reset()
+        entry = ScheduledUpdate()
+        entry.entity, entry.policy, entry.last = entity, policy, self.clock
+        entry.phase = len(self.entries) % policy.every
+        self.entries.append(entry)
+    
+    def due(self, entry, focus):
+        policy = entry.policy
+        if policy.mode == 'always':
+            return True
+        if policy.mode == 'every':
+            return (self.frame + entry.phase) % policy.every == 0
+        if policy.mode == 'visible':
+            return base.camNode.is_in_view(entry.entity)
+        radius_sq = fog_culling.radius_sq if policy.radius is None else policy.radius ** 2
+        return focus is None or (entry.entity.world_position - focus).length_squared() <= radius_sq
+    
+    @frame_phase('scheduled updates')
+    def update(self):
+        self.clock += time.dt
+        self.frame += 1
+        try:
+            focus = player.world_position
+        except NameError:  # no level has been built yet
+            focus = None
+        # Entities spawned by a tick land in the fresh list and join next frame
+        entries, self.entries = self.entries, []
+        alive = []
+        for entry in entries:
+            entity = entry.entity
+            if entity.is_empty():
+                continue
+            alive.append(entry)
+            if not entity.enabled or entity.ignore or not self.due(entry, focus):
+                self.stats['skipped'] += 1
+                continue
+            dt = min(self.clock - entry.last, MAX_CATCH_UP)
+            entry.last = self.clock
+            self.stats['ticked'] += 1
+            entity.tick(dt)
+        self.entries = alive + self.entries
+
+update_scheduler = UpdateScheduler()
+
+# ----------- B3313 SHADOWS -----------
+# Only the sun's shadow camera has this bit in its mask, so hiding a node under it
+# takes it out of the shadow pass without hiding it from the main camera.
+SHADOW_CASTER_MASK = BitMask32.bit(3)
+
+class ShadowFitter:
+    """Fits the sun's shadow map to the player instead of the whole scene.
+
+    lit_with_shadows_shader samples a single shadow map, so this is the near
+    cascade on its own: an orthographic volume of `radius` around a point a little
+    ahead of the player along the view, snapped to whole texels so it doesn't
+    shimmer as it follows. Dynamic casters outside it are dropped from the shadow
+    pass, so crowded rooms only render the nearby ones into the map.
+    """
+    radius = 30
+    lead = 0.5
+    distance = 100
+    caster_margin = 8
+    cull_interval = 0.1
+    
+    def __init__(self):
+        self.light_np = None
+        self.casters = []
+        self.timer = 0
+    
+    def attach(self, sun):
+        self.light_np = sun.find('**/+DirectionalLight')
+        if self.light_np.is_empty():
+            self.light_np = None
+            return
+        self.light_np.node().set_camera_mask(SHADOW_CASTER_MASK)
+    
+    @property
+    def active(self):
+        return self.light_np is not None and not self.light_np.is_empty()
+    
+    def reset(self):
+        self.casters = []
+    
+    def add_caster(self, entity):
+        """Register a dynamic caster; it stays out of the shadow pass until it is in range"""
+        if not self.active:
+            # No sun (the headless soak): update() never runs to prune, so don't hold on to it
+            return
+        entity.hide(SHADOW_CASTER_MASK)
+        self.casters.append(entity)
+    
+    @frame_phase('shadows')
+    def update(self, focus):
+        if not self.active:
+            return
+        forward = camera.get_quat(render).get_forward()
+        center = focus.get_pos(render) + forward * (self.radius * self.lead)
+        
+        # Park the shadow camera a fixed distance back along the light. Across the light
+        # it only moves in whole texels, so the map doesn't shimmer as it follows
+        node = self.light_np.node()
+        quat = self.light_np.get_quat(render)
+        direction, right, up = quat.get_forward(), quat.get_right(), quat.get_up()
+        texel = 2 * self.radius / node.get_shadow_buffer_size().x
+        snapped = (right * (round(center.dot(right) / texel) * texel)
+                   + up * (round(center.dot(up) / texel) * texel)
+                   + direction * center.dot(direction))
+        self.light_np.set_pos(render, snapped - direction * self.distance)
+        lens = node.get_lens()
+        lens.set_film_size(2 * self.radius, 2 * self.radius)
+        lens.set_film_offset(0, 0)
+        lens.set_near_far(self.distance - self.radius - self.caster_margin * 4, self.distance + self.radius)
+        
+        self.timer -= time.dt
+        if self.timer > 0:
+            return
+        self.timer = self.cull_interval
+        reach_sq = (self.radius + self.caster_margin) ** 2
+        live = []
+        for entity in self.casters:
+            if entity.is_empty():
+                continue
+            live.append(entity)
+            if (entity.get_pos(render) - center).length_squared() < reach_sq:
+                entity.show(SHADOW_CASTER_MASK)
+            else:
+                entity.hide(SHADOW_CASTER_MASK)
+        self.casters = live
+
+shadows = ShadowFitter()
+
+# ----------- B3313 SHADER WARM-UP -----------
+# Panda3D has no portable shader binary cache, but the NVIDIA and Mesa drivers keep
+# their own on disk. Pointing them into our cache folder keeps the compiled
+# binaries next to the baked geometry and out of the drivers' size-limited defaults.
+SHADER_CACHE_DIR = os.path.join(CACHE_DIR, 'shaders')
+
+def enable_driver_shader_cache():
+    """Must run before the window (and its GL context) is created"""
+    os.makedirs(SHADER_CACHE_DIR, exist_ok=True)
+    os.environ.setdefault('__GL_SHADER_DISK_CACHE', '1')
+    os.environ.setdefault('__GL_SHADER_DISK_CACHE_PATH', SHADER_CACHE_DIR)
+    os.environ.setdefault('__GL_SHADER_DISK_CACHE_SKIP_CLEANUP', '1')
+    os.environ.setdefault('MESA_SHADER_CACHE_DIR', SHADER_CACHE_DIR)
+    os.environ.setdefault('MESA_GLSL_CACHE_DIR', SHADER_CACHE_DIR)
+
+class ShaderWarmup:
+    """Draws every shader and render-state combination the game uses once into an offscreen
+    buffer, under the scene's lights (and so the shadow map), timing each one"""
+    size = 64
+    
+    def __init__(self):
+        self.report = []
+        self.buffer = None
+        self.fog = Fog('shader_warmup_fog')
+        self.fog.set_exp_density(0.02)
+    
+    def combinations(self, models):
+        """(label, model, shader, texture, fog) for everything a menu or level can draw"""
+        combos = []
+        for model in models:
+            combos.append((f'{model} unlit', model, None, None, False))
+            for fog in (False, True):
+                for texture in (None, 'white_cube'):
+                    label = f"{model} lit{' textured' if texture else ''}{' fog' if fog else ''}"
+                    combos.append((label, model, lit_with_shadows_shader, texture, fog))
+        combos.append(('menu face', 'sphere', face_shader, None, False))
+        return combos
+    
+    def begin(self, models):
+        """Open the offscreen buffer and return one step per combination; end() closes it"""
+        self.report = []
+        self.buffer = base.win.make_texture_buffer('shader_warmup', self.size, self.size)
+        if self.buffer is None:
+            print('No offscreen buffer: skipping shader warm-up')
+            return []
+        self.root = NodePath('shader_warmup')
+        # Same lights, shadow caster included, as the main scene
+        self.root.set_state(render.get_state())
+        self.camera = base.make_camera(self.buffer)
+        self.camera.reparent_to(self.root)
+        self.camera.set_pos(0, -4, 0)
+        steps = [lambda: self.render('(empty frame)', None, None, None, False)]
+        steps += [lambda combo=combo: self.render(*combo) for combo in self.combinations(models)]
+        return steps
+    
+    def render(self, label, model, shader, texture, fog):
+        entity = Entity(parent=self.root, model=model, shader=shader, texture=texture)
+        if shader is face_shader:
+            region_state = PTA_LVecBase4f.empty_array(FACE_MAX_REGIONS)
+            for i in range(FACE_MAX_REGIONS):
+                region_state[i] = LVecBase4f(1, 1, 0, 0)
+            entity.set_shader_input('region_state', region_state)
+            entity.set_shader_input('region_tint', PTA_LVecBase4f.empty_array(FACE_MAX_REGIONS))
+        if fog:
+            entity.set_fog(self.fog)
+        started = time.perf_counter()
+        base.graphicsEngine.render_frame()
+        base.graphicsEngine.sync_frame()
+        self.report.append((label, time.perf_counter() - started))
+        destroy_entity(entity)
+    
+    def end(self):
+        """Close the buffer and write the report; does nothing when no warm-up is open"""
+        if self.buffer is None:
+            return
+        # make_camera registered the camera with ShowBase and gave it a display region; undo both
+        if self.camera in base.camList:
+            base.camList.remove(self.camera)
+        self.buffer.remove_all_display_regions()
+        self.camera.remove_node()
+        base.graphicsEngine.remove_window(self.buffer)
+        self.root.remove_node()
+        self.buffer = self.camera = None
+        baseline = self.report[0][1] if self.report else 0
+        lines = [f'{(seconds - baseline) * 1000:8.1f} ms  {label}' for label, seconds in sorted(self.report[1:], key=lambda r: -r[1])]
+        total = sum(seconds - baseline for label, seconds in self.report[1:])
+        print(f'Shader warm-up: {len(lines)} combinations in {total * 1000:.0f} ms over a {baseline * 1000:.1f} ms empty frame')
+        for line in lines[:5]:
+            print(line)
+        try:
+            os.makedirs(SHADER_CACHE_DIR, exist_ok=True)
+            with open(os.path.join(SHADER_CACHE_DIR, 'warmup_report.txt'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        except OSError:
+            pass
+
+shader_warmup = ShaderWarmup()
+
+# ----------- B3313 ASSET PRELOAD -----------
+PRELOAD_MODELS = ['sphere', 'cube', 'cylinder', 'plane', 'quad', 'star']
+PRELOAD_TEXTURES = ['white_cube']
+MODEL_SUFFIXES = ['.bam', '.egg', '.ursinamesh', '.obj', '.gltf', '.glb']
+SPLASH_MIN_SECONDS = 4
+
+def find_model_file(name):
+    folders = [application.asset_folder, application.internal_models_compressed_folder, application.internal_models_folder]
+    for folder in folders:
+        for suffix in MODEL_SUFFIXES:
+            path = os.path.join(str(folder), name + suffix)
+            if os.path.exists(path):
+                return path
+    return None
+
+class AssetPreloader:
+    """Loads the preload manifest while the splash plays, so nothing pays for it mid-game.
+
+    .bam/.egg models go through Panda3D's async loader and land in its ModelPool;
+    everything else, then the offscreen shader warm-up, runs one item per frame
+    so the splash keeps animating.
+    """
+    def __init__(self):
+        self.steps = []
+        self.waiting = 0
+        self.total = 0
+        self.done = 0
+        self.missing = []
+        self.warmed = False
+        self.started = None
+        self.finished_at = None
+        self.driver = None
+        self.models = {}
+    
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 1
+    
+    @property
+    def finished(self):
+        return self.finished_at is not None
+    
+    @property
+    def found_models(self):
+        return [name for name in PRELOAD_MODELS if name not in self.missing]
+    
+    def start(self):
+        self.started = time.perf_counter()
+        for name in PRELOAD_MODELS:
+            path = find_model_file(name)
+            if path is None:
+                self.missing.append(name)
+            elif path.endswith(('.bam', '.egg')):
+                self.waiting += 1
+                loader.loadModel(Filename.from_os_specific(path), callback=lambda model, name=name: self.model_loaded(name, model))
+            else:
+                self.steps.append(lambda name=name: load_model(name))
+        for name in PRELOAD_TEXTURES:
+            self.steps.append(lambda name=name: load_texture(name))
+        for name in SOUND_MANIFEST:
+            if name not in audio.clips:
+                self.steps.append(lambda name=name: audio.load(name))
+        for kind in EMITTER_MANIFEST:
+            self.steps.append(lambda kind=kind: positional_audio.load(kind))
+        for name in LOD_LEVELS:
+            self.steps.append(lambda name=name: lod_models.build(name))
+        # Async loads count twice (the load and the pool hit); the warm-up adds an empty frame
+        self.total = len(self.steps) + self.waiting * 2 + len(shader_warmup.combinations(self.found_models)) + 1
+        # Eternal: skipping the splash clears the scene, and whatever is left still has to load
+        self.driver = Entity(name='asset_preloader', update=self.update, eternal=True)
+    
+    def model_loaded(self, name, model):
+        # Async load done; ursina's own load now comes straight from the ModelPool
+        self.models[name] = model
+        self.waiting -= 1
+        self.done += 1
+        self.steps.append(lambda: load_model(name))
+    
+    def update(self):
+        if self.finished:
+            return
+        if self.steps:
+            self.steps.pop(0)()
+            self.done += 1
+        elif self.waiting:
+            return
+        elif not self.warmed:
+            self.warmed = True
+            self.steps = shader_warmup.begin(self.found_models)
+        else:
+            self.finish()
+    
+    def skip_warmup(self):
+        """The splash was skipped: drop the warm-up still to come, closing its buffer if it is open.
+
+        Assets not loaded yet keep loading one per frame behind the menu.
+        """
+        if self.warmed:
+            # Asset steps all run before the warm-up starts, so only warm-up steps are left
+            self.steps.clear()
+        self.warmed = True
+        shader_warmup.end()
+    
+    def finish(self):
+        shader_warmup.end()
+        self.driver.eternal = False
+        destroy_entity(self.driver)
+        self.done = self.total
+        self.finished_at = time.perf_counter()
+        missing = f", not found: {', '.join(self.missing)}" if self.missing else ''
+        print(f"Preloaded {len(self.found_models)} models, {len(PRELOAD_TEXTURES)} textures "
+              f"and {len(SOUND_MANIFEST)} sounds in {self.finished_at - self.started:.2f}s{missing}")
+
+preloader = AssetPreloader()
 
 # ----------- SPLASH SCREEN -----------
 def show_splash_screen():
@@ -46,19 +1626,17 @@ def show_splash_screen():
     splash_bg = Entity(model='cube', scale=(50, 50, 1), position=(0, 0, -5), color=color.rgb(20, 20, 20))
     
     # Glitchy text with more distortion
-    splash_text = Text(
-        'TEAM SPECIALEMU AGI DIVISION',
+    splash_text = GlitchText(
+        ['TEAM SPECIALEMU AGI DIVISION'],
         position=(0, 0.2),
-        origin=(0, 0),
         scale=3.5,
         color=color.red
     )
     
     # Special 64 logo with flicker
-    special_64_text = Text(
-        'SPECIAL 64 EMULATOR v1.0',
+    special_64_text = GlitchText(
+        ['SPECIAL 64 EMULATOR v1.0', 'S̴P̶E̵C̴I̶A̷L̴ ̵6̶4̴', 'ERROR 404', '⬛⬛⬛'],
         position=(0, -0.1),
-        origin=(0, 0),
         scale=2.5,
         color=color.white
     )
@@ -72,6 +1650,23 @@ def show_splash_screen():
         color=color.dark_gray
     )
     
+    # Load everything the game needs while the splash plays
+    loading_text = Text('LOADING 0%', position=(0, -0.45), origin=(0, 0), scale=1, color=color.dark_gray)
+    splash_started = time.perf_counter()
+    preloader.start()
+    
+    # Go to the menu once preloading is done and the splash has had its time, whichever is later
+    def wait_for_preload():
+        if state['game_mode'] != 'splash':
+            return
+        percent = f'LOADING {int(preloader.progress * 100)}%'
+        if loading_text.text != percent:
+            loading_text.text = percent
+        if preloader.finished and time.perf_counter() - splash_started >= SPLASH_MIN_SECONDS:
+            transition_to_menu(splash_bg, splash_text, special_64_text, warning_text, loading_text, waiter)
+    
+    waiter = Entity(update=wait_for_preload)
+    
     # Glitch effect with more intensity
     def glitch_text():
         if random.random() < 0.5:
@@ -79,7 +1674,7 @@ def show_splash_screen():
             splash_text.scale = 3.5 + random.uniform(-0.5, 0.5)
             splash_text.position = (random.uniform(-0.1, 0.1), 0.2 + random.uniform(-0.1, 0.1))
         if random.random() < 0.3:
-            special_64_text.text = random.choice(['SPECIAL 64 EMULATOR v1.0', 'S̴P̶E̵C̴I̶A̷L̴ ̵6̶4̴', 'ERROR 404', '⬛⬛⬛'])
+            special_64_text.text = random.choice(list(special_64_text.variants))
             special_64_text.color = random.choice([color.white, color.red, color.black])
         if random.random() < 0.4:
             warning_text.enabled = not warning_text.enabled
@@ -87,35 +1682,458 @@ def show_splash_screen():
     Entity(update=glitch_text)
     
     # Play creepy hum
-    try:
-        menu_hum.play()
-    except:
-        pass
-    
-    # Transition to menu after 4 seconds
-    invoke(lambda: transition_to_menu(splash_bg, splash_text, special_64_text, warning_text), delay=4)
+    ambience.enter('menu')
 
 def transition_to_menu(*entities):
     for e in entities:
-        destroy(e)
-    try:
-        menu_hum.stop()
-    except:
-        pass
+        destroy_entity(e)
     state['game_mode'] = 'menu'
     setup_b3313_menu()
 
+# ----------- B3313 PROCEDURAL MESHES -----------
+def ellipsoid_mesh_data(center=(0, 0, 0), radii=(0.5, 0.5, 0.5), rings=12, segments=16):
+    """Vertices and triangles of a UV ellipsoid with its poles on the y axis"""
+    vertices = []
+    for r in range(rings + 1):
+        phi = math.pi * r / rings
+        y, ring_radius = math.cos(phi), math.sin(phi)
+        for s in range(segments + 1):
+            theta = 2 * math.pi * s / segments
+            vertices.append((
+                center[0] + radii[0] * ring_radius * math.sin(theta),
+                center[1] + radii[1] * y,
+                center[2] + radii[2] * ring_radius * math.cos(theta),
+            ))
+    triangles = []
+    for r in range(rings):
+        for s in range(segments):
+            a = r * (segments + 1) + s
+            b = a + segments + 1
+            triangles.extend(((a, a + 1, b), (a + 1, b + 1, b)))
+    return vertices, triangles
+
+def cylinder_mesh_data(segments=16):
+    """Vertices and triangles of a closed unit cylinder standing on y=0, like ursina's 'cylinder'"""
+    vertices = [(0, 0, 0), (0, 1, 0)]
+    for s in range(segments):
+        theta = 2 * math.pi * s / segments
+        x, z = 0.5 * math.sin(theta), 0.5 * math.cos(theta)
+        vertices.extend(((x, 0, z), (x, 1, z)))
+    triangles = []
+    for s in range(segments):
+        a, b = 2 + 2 * s, 2 + 2 * ((s + 1) % segments)
+        triangles.extend(((a, a + 1, b), (a + 1, b + 1, b), (0, a, b), (1, b + 1, a + 1)))
+    return orient_outward(vertices, triangles)
+
+def box_mesh_data():
+    """Vertices and triangles of a unit cube centred on the origin"""
+    vertices = [(x, y, z) for x in (-0.5, 0.5) for y in (-0.5, 0.5) for z in (-0.5, 0.5)]
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    triangles = []
+    for a, b, c, d in quads:
+        triangles.extend(((a, b, c), (a, c, d)))
+    return orient_outward(vertices, triangles)
+
+def orient_outward(vertices, triangles):
+    """Flip triangles of a convex shape so they face away from its centre, with the winding ellipsoid_mesh_data uses"""
+    center = [sum(v[i] for v in vertices) / len(vertices) for i in range(3)]
+    oriented = []
+    for a, b, c in triangles:
+        pa, pb, pc = Vec3(*vertices[a]), Vec3(*vertices[b]), Vec3(*vertices[c])
+        normal = (pb - pa).cross(pc - pa)
+        outward = (pa + pb + pc) / 3 - Vec3(*center)
+        oriented.append((a, c, b) if normal.dot(outward) > 0 else (a, b, c))
+    return vertices, oriented
+
+def region_mesh_data(region):
+    """Vertices and triangles of one FaceRegion, placed like an Entity with that position, scale and rotation_x"""
+    if region.shape == 'sphere':
+        vertices, triangles = ellipsoid_mesh_data(rings=max(4, region.detail * 2 // 3), segments=region.detail)
+    elif region.shape == 'cylinder':
+        vertices, triangles = cylinder_mesh_data(region.detail)
+    else:
+        vertices, triangles = box_mesh_data()
+    sin_t, cos_t = math.sin(math.radians(region.tilt)), math.cos(math.radians(region.tilt))
+    placed = []
+    for x, y, z in vertices:
+        x, y, z = x * region.size[0], y * region.size[1], z * region.size[2]
+        # Positive rotation_x dips the front (+z) down
+        y, z = y * cos_t - z * sin_t, y * sin_t + z * cos_t
+        placed.append((x + region.center[0], y + region.center[1], z + region.center[2]))
+    return placed, triangles
+
+def mesh_vertex_array(mesh, column):
+    """(vertex data, array index, byte offset, stride) of the array holding `column`, or None
+
+    Ursina interleaves position, colour and uv in one array, so callers write through the stride.
+    """
+    geom_np = mesh if isinstance(mesh.node(), GeomNode) else mesh.find('**/+GeomNode')
+    if geom_np.is_empty():
+        return None
+    vdata = geom_np.node().modify_geom(0).modify_vertex_data()
+    vformat = vdata.get_format()
+    for i in range(vformat.get_num_arrays()):
+        array_format = vformat.get_array(i)
+        if array_format.has_column(column):
+            return vdata, i, array_format.get_column(column).get_start(), array_format.get_stride()
+    return None
+
+FaceRegion = namedtuple('FaceRegion', 'name shape center size tilt color visible grabbable stiffness detail')
+
+FACE_MAX_REGIONS = 16
+
+# Region id rides in uv.x. Per-region state is two uniform arrays:
+# region_state = (visible, vertical squash, squash pivot y, unused), region_tint = (rgb, mix)
+face_shader = Shader(name='b3313_face_shader', language=Shader.GLSL, vertex='''#version 140
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform vec4 region_state[16];
+uniform vec4 region_tint[16];
+in vec4 p3d_Vertex;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+out vec4 vertex_color;
+
+void main() {
+    int region = int(p3d_MultiTexCoord0.x + 0.5);
+    vec4 state = region_state[region];
+    vec4 position = p3d_Vertex;
+    position.y = state.z + (position.y - state.z) * state.y;
+    // Hidden regions collapse to a point and produce no fragments
+    gl_Position = state.x > 0.5 ? p3d_ModelViewProjectionMatrix * position : vec4(0.0);
+    vec4 tint = region_tint[region];
+    vertex_color = vec4(mix(p3d_Color.rgb, tint.rgb, tint.a), p3d_Color.a);
+}
+''',
+fragment='''#version 140
+uniform vec4 p3d_ColorScale;
+in vec4 vertex_color;
+out vec4 fragColor;
+
+void main() {
+    fragColor = vertex_color * p3d_ColorScale;
+}
+''')
+
+class DeformableFace(Entity):
+    """SM64-style stretchy face: one mesh whose vertices are springs to a rest pose.
+
+    Every part is a region of the same mesh, so the whole head is one draw call.
+    Colours are baked into the vertices; visibility, blinking and glitch tints
+    are uniform writes. The springs are integrated in one NumPy step, and a face
+    nobody is pulling on settles, snaps to rest and sleeps.
+    """
+    damping = 9
+    grab_stiffness = 220
+    grab_falloff = 0.9
+    max_stretch = 2
+    sleep_epsilon = 0.002
+    step_dt = 1 / 120
+
+    def __init__(self, regions, **kwargs):
+        super().__init__(**kwargs)
+        if len(regions) > FACE_MAX_REGIONS:
+            raise ValueError(f'a face has at most {FACE_MAX_REGIONS} regions, got {len(regions)}')
+        self.regions = {}
+        self.region_index = {}
+        vertices, triangles, colors, uvs, region_ids, stiffness, grabbable = [], [], [], [], [], [], []
+        for index, region in enumerate(regions):
+            region_vertices, region_triangles = region_mesh_data(region)
+            first = len(vertices)
+            triangles.extend((a + first, b + first, c + first) for a, b, c in region_triangles)
+            vertices.extend(region_vertices)
+            colors.extend([region.color] * len(region_vertices))
+            uvs.extend([(index, 0)] * len(region_vertices))
+            region_ids.extend([index] * len(region_vertices))
+            stiffness.extend([region.stiffness] * len(region_vertices))
+            grabbable.extend([region.grabbable] * len(region_vertices))
+            self.regions[region.name] = (first, len(vertices))
+            self.region_index[region.name] = index
+        
+        self.model = Mesh(vertices=vertices, triangles=triangles, colors=colors, uvs=uvs, static=False)
+        # Vertices move every frame, so don't let stale bounds cull the head
+        geom_np = self.model if isinstance(self.model.node(), GeomNode) else self.model.find('**/+GeomNode')
+        if not geom_np.is_empty():
+            geom_np.node().set_bounds(OmniBoundingVolume())
+            geom_np.node().set_final(True)
+        
+        # The shader reads these arrays by reference, so writing an entry is all an update costs
+        self.region_state = PTA_LVecBase4f.empty_array(FACE_MAX_REGIONS)
+        self.region_tint = PTA_LVecBase4f.empty_array(FACE_MAX_REGIONS)
+        for index, region in enumerate(regions):
+            self.region_state[index] = LVecBase4f(1 if region.visible else 0, 1, region.center[1], 0)
+        self.shader = face_shader
+        self.set_shader_input('region_state', self.region_state)
+        self.set_shader_input('region_tint', self.region_tint)
+        
+        self.sleeping = True
+        self.grabbed = None
+        self._ray = CollisionRay()
+        if np is None:
+            print('numpy not found: the menu head will not stretch')
+            return
+        
+        self.rest = np.array(vertices, dtype=np.float32)
+        self.positions = self.rest.copy()
+        self.velocities = np.zeros_like(self.rest)
+        self.region_ids = np.array(region_ids)
+        self.stiffness = np.array(stiffness, dtype=np.float32)[:, None]
+        self.grabbable = np.array(grabbable)
+        self.weights = np.zeros((len(vertices), 1), dtype=np.float32)
+        self.grab_delta = np.zeros(3, dtype=np.float32)
+        self._positions_array = None
+        layout = mesh_vertex_array(self.model, 'vertex')
+        if layout is not None:
+            vdata, index, start, stride = layout
+            handle = vdata.modify_array_handle(index)
+            # A writable image of the whole array; positions are a float32 view into its vertex column
+            raw = np.frombuffer(bytearray(handle.get_data()), dtype=np.uint8).reshape(vdata.get_num_rows(), stride)
+            self._positions_array = (vdata, index, raw, raw[:, start:start + 12].view(np.float32))
+    
+    @property
+    def region_names(self):
+        return list(self.regions)
+    
+    def mouse_ray(self):
+        """The mouse ray in this entity's space, as (origin, unit direction)"""
+        self._ray.set_from_lens(base.camNode, mouse.x * 2 / window.aspect_ratio, mouse.y * 2)
+        origin = self.get_relative_point(base.cam, self._ray.get_origin())
+        direction = self.get_relative_vector(base.cam, self._ray.get_direction())
+        direction.normalize()
+        return np.array(origin, dtype=np.float32), np.array(direction, dtype=np.float32)
+    
+    def pick(self, radius=0.6):
+        """Cast one ray from the mouse against the mesh; returns the front-most grabbable vertex or None"""
+        if np is None:
+            return None
+        origin, direction = self.mouse_ray()
+        offsets = self.positions - origin
+        t = offsets @ direction
+        miss = offsets - t[:, None] * direction
+        dist_sq = np.einsum('ij,ij->i', miss, miss)
+        visible = np.array([self.region_state[i][0] > 0.5 for i in range(len(self.regions))])
+        candidates = (t > 0) & (dist_sq < radius * radius) & self.grabbable & visible[self.region_ids]
+        if not candidates.any():
+            return None
+        return int(np.flatnonzero(candidates)[np.argmin(t[candidates])])
+    
+    def grab(self, vertex):
+        """Start pulling on `vertex`; its region follows with a smooth falloff"""
+        origin, direction = self.mouse_ray()
+        self.grabbed = vertex
+        self.grab_depth = float((self.positions[vertex] - origin) @ direction)
+        self.grab_offset = origin + direction * self.grab_depth - self.positions[vertex]
+        
+        rest_distance = np.linalg.norm(self.rest - self.rest[vertex], axis=1)
+        weights = np.exp(-(rest_distance / self.grab_falloff) ** 2)
+        weights[self.region_ids != self.region_ids[vertex]] = 0
+        self.weights[:, 0] = weights
+        self.sleeping = False
+    
+    def drag_to_mouse(self):
+        if self.grabbed is None:
+            return
+        origin, direction = self.mouse_ray()
+        target = origin + direction * self.grab_depth - self.grab_offset
+        delta = target - self.rest[self.grabbed]
+        length = np.linalg.norm(delta)
+        if length > self.max_stretch:
+            delta *= self.max_stretch / length
+        self.grab_delta[:] = delta
+    
+    def release(self):
+        self.grabbed = None
+        self.weights[:] = 0
+    
+    def step(self, dt):
+        """Integrate every vertex at once; does nothing while the face is asleep"""
+        if np is None or self.sleeping:
+            return
+        steps = max(1, min(8, math.ceil(dt / self.step_dt)))
+        h = dt / steps
+        for i in range(steps):
+            displacement = self.positions - self.rest
+            force = -self.stiffness * displacement - self.damping * self.velocities
+            if self.grabbed is not None:
+                force += self.grab_stiffness * self.weights * (self.grab_delta - displacement)
+            self.velocities += force * h
+            self.positions += self.velocities * h
+        
+        if self.grabbed is None:
+            moving = np.abs(self.velocities).max()
+            stretched = np.abs(self.positions - self.rest).max()
+            if moving < self.sleep_epsilon and stretched < self.sleep_epsilon:
+                self.positions[:] = self.rest
+                self.velocities[:] = 0
+                self.sleeping = True
+        self.upload()
+    
+    def upload(self):
+        if self._positions_array is None:
+            self.model.vertices = self.positions.tolist()
+            self.model.generate()
+            return
+        vdata, index, raw, column = self._positions_array
+        column[:] = self.positions
+        vdata.modify_array_handle(index).copy_data_from(raw)
+    
+    def region_visible(self, name):
+        return self.region_state[self.region_index[name]][0] > 0.5
+    
+    def set_region_visible(self, name, visible):
+        index = self.region_index[name]
+        state = LVecBase4f(self.region_state[index])
+        state[0] = 1 if visible else 0
+        self.region_state[index] = state
+    
+    def set_region_squash(self, name, amount):
+        """Squash a region vertically about its centre; 1 is its normal height"""
+        index = self.region_index[name]
+        state = LVecBase4f(self.region_state[index])
+        state[1] = amount
+        self.region_state[index] = state
+    
+    def set_region_tint(self, name, value, amount=1):
+        self.region_tint[self.region_index[name]] = LVecBase4f(value[0], value[1], value[2], amount)
+    
+    def flash_region(self, name, value, duration):
+        """Recolour one region for `duration` seconds"""
+        self.set_region_tint(name, value)
+        invoke(self.set_region_tint, name, value, 0, delay=duration)
+
+# ----------- B3313 LOD PRIMITIVES -----------
+# 'sphere' and 'cylinder' are everywhere (coins, enemies, void geometry, particles),
+# so they get tessellation levels, finest first. Camera distance is measured in each
+# shape's own space, so the switch distances scale with the entity: each level is
+# picked by how much of the screen the shape covers.
+LOD_LEVELS = {
+    'sphere': [(16, 24), (10, 16), (6, 10), (4, 6)],  # (rings, segments)
+    'cylinder': [32, 16, 10, 6],                       # segments
+}
+# Screen height a unit-sized shape covers when it drops to the next level
+LOD_SCREEN_FRACTIONS = (0.25, 0.08, 0.025)
+LOD_REFERENCE_FOV = 90
+
+def lod_switch_distances(fov=LOD_REFERENCE_FOV):
+    """Camera distances (for a unit-sized shape) where each level hands over to the next"""
+    span = 2 * math.tan(math.radians(fov) / 2)
+    return [1 / (fraction * span) for fraction in LOD_SCREEN_FRACTIONS]
+
+def lod_center(name):
+    return Point3(0, 0, 0) if name == 'sphere' else Point3(0, 0.5, 0)
+
+def lod_level_mesh(name, level):
+    """One tessellation level of a primitive, with normals for the lit shaders"""
+    if name == 'sphere':
+        rings, segments = level
+        vertices, triangles = ellipsoid_mesh_data(rings=rings, segments=segments)
+        normals = [(x * 2, y * 2, z * 2) for x, y, z in vertices]
+    else:
+        vertices, triangles = cylinder_mesh_data(level)
+        # Smooth sides; the two cap centres point straight up and down
+        normals = [(0, -1, 0), (0, 1, 0)] + [(x * 2, 0, z * 2) for x, y, z in vertices[2:]]
+    return Mesh(vertices=vertices, triangles=triangles, normals=normals)
+
+class LodInstance:
+    __slots__ = ('root', 'levels', 'level', 'center')
+
+class LodModels:
+    """Shared tessellation levels of the primitives; every entity gets a node instancing them.
+
+    Levels switch with hysteresis: a shape drops to a coarser level only once it
+    is `hysteresis` (a fraction) beyond a switch distance, and comes back only once
+    it is that much inside it, so shapes parked on a switch distance don't flip
+    every frame. Distances are measured in each shape's own space every `interval`
+    seconds. With hysteresis 0, a plain Panda3D LODNode switches in C++ instead.
+    """
+    hysteresis = 0.1
+    interval = 0.1
+    
+    def __init__(self):
+        self.levels = {}
+        self.templates = {}
+        self.instances = []
+        self.driver = None
+        self.timer = 0
+    
+    def reset(self):
+        """Forget tracked shapes; call after a scene clear, which destroys them and the driver"""
+        self.instances = []
+        self.driver = Entity(name='lod_switcher', update=self.update)
+    
+    def build(self, name):
+        """Tessellate `name`'s levels, and the LODNode template used without hysteresis"""
+        self.levels[name] = [lod_level_mesh(name, level) for level in LOD_LEVELS[name]]
+        node = LODNode(f'{name}_lod')
+        node.set_center(lod_center(name))
+        template = NodePath(node)
+        near = 0
+        for mesh, far in zip(self.levels[name], lod_switch_distances() + [float('inf')]):
+            mesh.instance_to(template)
+            node.add_switch(far, near)
+            near = far
+        self.templates[name] = template
+        return template
+    
+    def get(self, name):
+        """A model for `name`: an LOD node for the primitives above, the name itself for anything else"""
+        if name not in LOD_LEVELS:
+            return name
+        if name not in self.levels:
+            self.build(name)
+        if not self.hysteresis:
+            return self.templates[name].copy_to(NodePath())
+        if self.driver is None:
+            self.reset()
+        instance = LodInstance()
+        instance.root = NodePath(f'{name}_lod')
+        instance.levels = [mesh.instance_to(instance.root) for mesh in self.levels[name]]
+        instance.center = lod_center(name)
+        # Start in the middle; the first pass moves it to the right level
+        instance.level = 1
+        for i, level in enumerate(instance.levels):
+            if i != instance.level:
+                level.hide()
+        self.instances.append(instance)
+        return instance.root
+    
+    def update(self):
+        self.timer -= time.dt
+        if self.timer > 0 or not self.instances:
+            return
+        self.timer = self.interval
+        switches = lod_switch_distances()
+        stay_finer = [d * (1 + self.hysteresis) for d in switches]
+        stay_coarser = [d * (1 - self.hysteresis) for d in switches]
+        eye = camera.get_pos(render)
+        live = []
+        for instance in self.instances:
+            root = instance.root
+            # We hold the root, so destroying its entity orphans it rather than emptying it;
+            # cached rooms are only stashed and stay under render
+            if root.is_empty() or root.get_top() != render:
+                continue
+            live.append(instance)
+            dist = (root.get_relative_point(render, eye) - instance.center).length()
+            level = instance.level
+            while level < len(switches) and dist > stay_finer[level]:
+                level += 1
+            while level > 0 and dist < stay_coarser[level - 1]:
+                level -= 1
+            if level != instance.level:
+                instance.levels[instance.level].hide()
+                instance.levels[level].show()
+                instance.level = level
+        self.instances = live
+
+lod_models = LodModels()
+
 # ----------- B3313 MARIO HEAD MENU -----------
 class B3313MarioHead(Entity):
     def __init__(self):
         super().__init__()
         self.original_position = Vec3(0, 0, 0)
         self.mouse_sensitivity = 2
-        self.elasticity = 0.15
-        self.max_stretch = 2
         self.is_being_grabbed = False
-        self.grab_offset = Vec3()
-        self.face_parts = {}
         self.glitch_timer = 0
         
         # Create Mario's head with worse corruptions
@@ -125,153 +2143,77 @@ class B3313MarioHead(Entity):
         self.create_b3313_background()
     
     def setup_head(self):
-        """Create Mario's head with heavier B3313 corruptions"""
+        """Create Mario's head with heavier B3313 corruptions, as one mesh with a region per part"""
         # Main head - more likely to be distorted
         head_color = color.peach if random.random() > 0.3 else random.choice([color.black, color.red, color.green])
-        self.head = Entity(
-            model='sphere', 
-            color=head_color, 
-            scale=3.5,
-            position=(0, 0, 0),
-            parent=self
-        )
         
         # Hat - often missing or corrupted
         hat_color = color.red if random.random() > 0.4 else random.choice([color.black, color.blue, color.white])
-        self.hat = Entity(
-            model='sphere',
-            color=hat_color,
-            scale=(3.7, 1.7, 3.7),
-            position=(0, 1.3, 0),
-            parent=self,
-            enabled=random.random() > 0.2
-        )
-        
-        # Hat brim
-        self.hat_brim = Entity(
-            model='cylinder',
-            color=hat_color,
-            scale=(4.5, 0.3, 4.5),
-            position=(0, 0.4, 0.6),
-            rotation=(15, 0, 0),
-            parent=self,
-            enabled=self.hat.enabled
-        )
+        hat_enabled = random.random() > 0.2
         
         # M emblem - highly corrupted
         emblem_text = 'M' if random.random() > 0.5 else random.choice(['W', 'L', '?', '⬛', 'X', 'Z'])
-        self.m_emblem = Entity(
-            model='cube',
-            color=color.white if random.random() > 0.3 else color.black,
-            scale=(1, 1, 0.2),
-            position=(0, 0.6, 1.6),
-            parent=self,
-            enabled=self.hat.enabled
-        )
+        emblem_color = color.white if random.random() > 0.3 else color.black
         
         # Eyes - often asymmetric or glitched
-        self.left_eye = Entity(
-            model='sphere',
-            color=color.black if random.random() > 0.2 else random.choice([color.red, color.green, color.white]),
-            scale=(0.4, 0.5, 0.4),
-            position=(-0.7, 0.3, 1.4),
-            parent=self,
-            enabled=random.random() > 0.1
-        )
-        
-        self.right_eye = Entity(
-            model='sphere',
-            color=color.black if random.random() > 0.2 else random.choice([color.red, color.green, color.white]),
-            scale=(0.4, 0.5, 0.4),
-            position=(0.7, 0.3, 1.4),
-            parent=self,
-            enabled=random.random() > 0.1
-        )
+        left_eye_color = color.black if random.random() > 0.2 else random.choice([color.red, color.green, color.white])
+        left_eye_enabled = random.random() > 0.1
+        right_eye_color = color.black if random.random() > 0.2 else random.choice([color.red, color.green, color.white])
+        right_eye_enabled = random.random() > 0.1
         
         # Nose - sometimes elongated
-        self.nose = Entity(
-            model='sphere',
-            color=color.peach if random.random() > 0.3 else color.black,
-            scale=(0.5, 0.4, 0.8 if random.random() > 0.2 else 1.5),
-            position=(0, -0.2, 1.5),
-            parent=self
-        )
+        nose_color = color.peach if random.random() > 0.3 else color.black
+        nose_length = 0.8 if random.random() > 0.2 else 1.5
         
         # Mustache - often corrupted
-        self.mustache = Entity(
-            model='cube',
-            color=color.brown if random.random() > 0.3 else random.choice([color.black, color.red]),
-            scale=(1.5, 0.2, 0.4),
-            position=(0, -0.5, 1.3),
-            parent=self,
-            enabled=random.random() > 0.15
-        )
+        mustache_color = color.brown if random.random() > 0.3 else random.choice([color.black, color.red])
+        mustache_enabled = random.random() > 0.15
         
         # Ears - sometimes missing
-        self.left_ear = Entity(
-            model='sphere',
-            color=color.peach,
-            scale=(0.7, 0.9, 0.5),
-            position=(-1.6, 0, 0.3),
-            parent=self,
-            enabled=random.random() > 0.2
-        )
+        left_ear_enabled = random.random() > 0.2
+        right_ear_enabled = random.random() > 0.2
         
-        self.right_ear = Entity(
-            model='sphere',
-            color=color.peach,
-            scale=(0.7, 0.9, 0.5),
-            position=(1.6, 0, 0.3),
-            parent=self,
-            enabled=random.random() > 0.2
-        )
+        # name, shape, position, scale, rotation_x, colour, visible, grabbable, stiffness, detail
+        self.face = DeformableFace([
+            FaceRegion('head', 'sphere', (0, 0, 0), (3.5, 3.5, 3.5), 0, tuple(head_color), True, True, 140, 24),
+            FaceRegion('hat', 'sphere', (0, 1.3, 0), (3.7, 1.7, 3.7), 0, tuple(hat_color), hat_enabled, False, 140, 24),
+            FaceRegion('hat_brim', 'cylinder', (0, 0.4, 0.6), (4.5, 0.3, 4.5), 15, tuple(hat_color), hat_enabled, False, 140, 24),
+            FaceRegion('m_emblem', 'cube', (0, 0.6, 1.6), (1, 1, 0.2), 0, tuple(emblem_color), hat_enabled, False, 140, 1),
+            FaceRegion('left_eye', 'sphere', (-0.7, 0.3, 1.4), (0.4, 0.5, 0.4), 0, tuple(left_eye_color), left_eye_enabled, False, 140, 10),
+            FaceRegion('right_eye', 'sphere', (0.7, 0.3, 1.4), (0.4, 0.5, 0.4), 0, tuple(right_eye_color), right_eye_enabled, False, 140, 10),
+            FaceRegion('nose', 'sphere', (0, -0.2, 1.5), (0.5, 0.4, nose_length), 0, tuple(nose_color), True, True, 70, 12),
+            FaceRegion('mustache', 'cube', (0, -0.5, 1.3), (1.5, 0.2, 0.4), 0, tuple(mustache_color), mustache_enabled, False, 140, 1),
+            FaceRegion('left_ear', 'sphere', (-1.6, 0, 0.3), (0.7, 0.9, 0.5), 0, tuple(color.peach), left_ear_enabled, True, 60, 12),
+            FaceRegion('right_ear', 'sphere', (1.6, 0, 0.3), (0.7, 0.9, 0.5), 0, tuple(color.peach), right_ear_enabled, True, 60, 12),
+        ], parent=self)
         
-        # Store grabbable parts
-        self.grabbable_parts = {
-            'nose': self.nose,
-            'left_ear': self.left_ear,
-            'right_ear': self.right_ear,
-            'head': self.head
-        }
+        # Parts that glitch in and out together
+        self.glitch_parts = [['left_eye'], ['right_eye'], ['mustache'], ['hat', 'hat_brim', 'm_emblem']]
     
     def create_b3313_background(self):
-        """Create a more unsettling B3313 background"""
+        """Create a more unsettling B3313 background from one of the cached variants"""
+        variant = random.randrange(MENU_BACKGROUND_VARIANTS)
+        voids, static_stars, moving_stars = menu_background_rolls(variant)
+        
         # Dark void with more chaotic geometry
-        for i in range(50):
-            entity_type = random.choice(['cube', 'sphere', 'cylinder'])
-            void_entity = Entity(
-                model=entity_type,
-                color=random.choice([color.black, color.dark_gray, color.red]),
-                scale=random.uniform(1, 7),
-                position=(
-                    random.uniform(-30, 30),
-                    random.uniform(-20, 20),
-                    random.uniform(-40, -10)
-                )
-            )
+        for v in voids:
+            void_entity = Entity(model=lod_models.get(v['model']), color=v['color'], scale=v['scale'], position=v['position'])
             # Erratic rotation
-            void_entity.animate('rotation', Vec3(360, 360, 360), duration=random.uniform(5, 20), loop=True)
-            if random.random() < 0.4:
-                void_entity.animate('scale', void_entity.scale * random.uniform(0.5, 1.5), duration=0.5, loop=True)
+            void_entity.animate('rotation', Vec3(360, 360, 360), duration=v['spin'], loop=True)
+            if v['pulse']:
+                void_entity.animate('scale', void_entity.scale * v['pulse'], duration=0.5, loop=True)
+            governor.add_decor(void_entity)
         
-        # Corrupted stars with more glitches
+        # Corrupted stars: the still ones are baked, the glitching ones stay Entities
+        self.static_stars = Entity(model=geometry_cache.load('menu_stars', variant, bake_menu_stars))
         self.stars = []
-        for i in range(30):
-            star = Entity(
-                model='cube',
-                color=random.choice([color.yellow, color.red, color.black, color.white, color.green]),
-                scale=random.uniform(0.1, 0.4),
-                position=(
-                    random.uniform(-20, 20),
-                    random.uniform(-15, 15),
-                    random.uniform(-30, -5)
-                )
-            )
-            # Glitchy movement
-            if random.random() < 0.5:
-                star.animate('position', star.position + Vec3(random.uniform(-8, 8), random.uniform(-5, 5), 0), duration=0.2, loop=True)
+        for star_color, scale, position, offset in moving_stars:
+            star = Entity(model='cube', color=Vec4(*star_color), scale=scale, position=position)
+            star.animate('position', star.position + Vec3(*offset), duration=0.2, loop=True)
             self.stars.append(star)
+            governor.add_decor(star)
     
+    @frame_phase('mario head')
     def update(self):
         """Update with intensified B3313 glitches"""
         # Random glitches
@@ -280,54 +2222,22 @@ class B3313MarioHead(Entity):
             self.glitch_timer = 0
             self.apply_glitch()
         
-        # Original interaction code
         if not mouse.locked:
-            hovered_part = None
-            for part_name, part in self.grabbable_parts.items():
-                if distance(mouse.world_point, part.world_position) < 1:
-                    hovered_part = part_name
-                    break
-            
-            if held_keys['left mouse'] and hovered_part:
+            # Grab with a single ray against the face mesh
+            if held_keys['left mouse']:
                 if not self.is_being_grabbed:
-                    self.is_being_grabbed = True
-                    self.grabbed_part = hovered_part
-                    self.grab_offset = mouse.world_point - self.grabbable_parts[hovered_part].world_position
-                
+                    vertex = self.face.pick()
+                    if vertex is not None:
+                        self.is_being_grabbed = True
+                        self.face.grab(vertex)
                 if self.is_being_grabbed:
-                    target_pos = mouse.world_point - self.grab_offset
-                    current_part = self.grabbable_parts[self.grabbed_part]
-                    
-                    stretch_amount = distance(target_pos, current_part.world_position)
-                    if stretch_amount < self.max_stretch:
-                        current_part.position = lerp(current_part.position, target_pos, time.dt * 10)
-                        
-                        stretch_factor = 1 + (stretch_amount * 0.3)
-                        current_part.scale = lerp(current_part.scale, current_part.scale * stretch_factor, time.dt * 5)
-            else:
+                    self.face.drag_to_mouse()
+            elif self.is_being_grabbed:
+                # Let go: the springs bounce the face back
                 self.is_being_grabbed = False
-                
-                # Return parts with elastic bounce
-                for part_name, part in self.grabbable_parts.items():
-                    original_pos = Vec3(0, 0, 0)
-                    if part_name == 'left_ear':
-                        original_pos = Vec3(-1.6, 0, 0.3)
-                    elif part_name == 'right_ear':
-                        original_pos = Vec3(1.6, 0, 0.3)
-                    elif part_name == 'nose':
-                        original_pos = Vec3(0, -0.2, 1.5)
-                    
-                    part.position = lerp(part.position, original_pos, time.dt * self.elasticity * 10)
-                    
-                    original_scale = 1
-                    if part_name == 'nose':
-                        original_scale = Vec3(0.5, 0.4, 0.8)
-                    elif 'ear' in part_name:
-                        original_scale = Vec3(0.7, 0.9, 0.5)
-                    elif part_name == 'head':
-                        original_scale = Vec3(3.5, 3.5, 3.5)
-                    
-                    part.scale = lerp(part.scale, original_scale, time.dt * 8)
+                self.face.release()
+            
+            self.face.step(time.dt)
             
             # Head movement with more violent twitches
             if not self.is_being_grabbed:
@@ -345,20 +2255,18 @@ class B3313MarioHead(Entity):
         glitch_type = random.choice(['color', 'scale', 'visibility', 'position', 'teleport'])
         
         if glitch_type == 'color':
-            part = random.choice(list(self.grabbable_parts.values()))
-            original_color = part.color
-            part.color = random.choice([color.black, color.red, color.green, color.white])
-            invoke(setattr, part, 'color', original_color, delay=0.15)
+            region = random.choice(self.face.region_names)
+            self.face.flash_region(region, random.choice([color.black, color.red, color.green, color.white]), 0.15)
         
         elif glitch_type == 'scale':
             self.scale = Vec3(3.5 + random.uniform(-1, 1), 3.5 + random.uniform(-1, 1), 3.5)
             invoke(setattr, self, 'scale', 3.5, delay=0.2)
         
         elif glitch_type == 'visibility':
-            part = random.choice([self.left_eye, self.right_eye, self.mustache, self.hat])
-            if hasattr(part, 'enabled'):
-                part.enabled = not part.enabled
-                invoke(setattr, part, 'enabled', True, delay=0.3)
+            parts = random.choice(self.glitch_parts)
+            for name in parts:
+                self.face.set_region_visible(name, not self.face.region_visible(name))
+                invoke(self.face.set_region_visible, name, True, delay=0.3)
         
         elif glitch_type == 'position':
             self.position += Vec3(random.uniform(-2, 2), random.uniform(-2, 2), 0)
@@ -370,20 +2278,27 @@ class B3313MarioHead(Entity):
     
     def blink(self):
         """More erratic corrupted blink"""
-        original_scale_y = self.left_eye.scale_y
         blink_scale = 0.05 if random.random() > 0.3 else 0
-        self.left_eye.animate('scale_y', blink_scale, duration=0.05, curve=curve.in_out_sine)
-        self.right_eye.animate('scale_y', blink_scale, duration=0.05, curve=curve.in_out_sine)
-        invoke(setattr, self.left_eye, 'scale_y', original_scale_y, delay=0.1)
-        invoke(setattr, self.right_eye, 'scale_y', original_scale_y, delay=0.1)
+        for eye in ('left_eye', 'right_eye'):
+            self.face.set_region_squash(eye, blink_scale)
+            invoke(self.face.set_region_squash, eye, 1, delay=0.1)
 
 # ----------- B3313 MENU SYSTEM -----------
 def setup_b3313_menu():
     """Set up the enhanced B3313 1.0 corrupted menu"""
     # Clear existing entities
-    for e in scene.entities:
-        if e not in [camera, mouse, window.fps_counter, window.exit_button]:
-            destroy(e)
+    for e in scene.entities[:]:
+        if e not in [camera, mouse] and not e.eternal:
+            destroy_entity(e)
+    room_transition.reset()
+    tweens.reset()
+    messages.reset()
+    positional_audio.reset()
+    fog_culling.reset()
+    update_scheduler.reset()
+    lod_models.reset()
+    governor.reset()
+    shadows.reset()
     
     # Reset camera for menu
     camera.parent = scene
@@ -396,17 +2311,13 @@ def setup_b3313_menu():
     scene.fog_density = 0.08
     
     # Play menu hum
-    try:
-        menu_hum.play()
-    except:
-        pass
+    ambience.enter('menu')
     
     # Create corrupted Mario head
     global mario_head
     mario_head = B3313MarioHead()
     
     # Title with heavy corruption
-    title_texts = []
     title_variations = [
         'B3313 1.0',
         'B̸3̷3̶1̴3̵ ̶1̵.̴0̶',
@@ -417,36 +2328,30 @@ def setup_b3313_menu():
         'WAKE UP'
     ]
     
-    for i, text in enumerate(title_variations):
-        t = Text(
-            text,
-            position=(0, 0.4),
-            origin=(0, 0),
-            scale=5,
-            color=color.red if i == 0 else random.choice([color.black, color.red, color.green]),
-            enabled=(i == 0)
-        )
-        title_texts.append(t)
+    title_colors = [color.red] + [random.choice([color.black, color.red, color.green]) for text in title_variations[1:]]
+    title_text = GlitchText(title_variations, position=(0, 0.4), scale=5, color=title_colors[0])
     
     # Cycle through title variations with more frequency
     def cycle_title():
-        current = None
-        for i, t in enumerate(title_texts):
-            if t.enabled:
-                current = i
-                t.enabled = False
-                break
-        next_idx = (current + 1) % len(title_texts)
-        title_texts[next_idx].enabled = True
+        next_idx = (title_variations.index(title_text.text) + 1) % len(title_variations)
+        title_text.text = title_variations[next_idx]
+        title_text.color = title_colors[next_idx]
         invoke(cycle_title, delay=random.uniform(1, 5))
     
     invoke(cycle_title, delay=3)
     
     # Start text with aggressive glitches
-    start_text = Text(
+    start_variations = [
         'PRESS START',
+        'P̸R̷E̶S̵S̴ ̵S̶T̸A̷R̶T̵',
+        'ENTER NOW',
+        'WAKE UP',
+        'RUN',
+        '⬛⬛⬛⬛⬛'
+    ]
+    start_text = GlitchText(
+        start_variations,
         position=(0, -0.35),
-        origin=(0, 0),
         scale=3,
         color=color.white
     )
@@ -454,22 +2359,18 @@ def setup_b3313_menu():
     # Glitchy start text
     def glitch_start():
         if random.random() < 0.5:
-            start_text.text = random.choice([
-                'PRESS START',
-                'P̸R̷E̶S̵S̴ ̵S̶T̸A̷R̶T̵',
-                'ENTER NOW',
-                'WAKE UP',
-                'RUN',
-                '⬛⬛⬛⬛⬛'
-            ])
+            start_text.text = random.choice(start_variations)
         start_text.color = random.choice([color.white, color.red, color.green, color.black])
         start_text.position = (random.uniform(-0.1, 0.1), -0.35 + random.uniform(-0.1, 0.1))
     
     start_text.animate('color', color.gray, duration=0.8, curve=curve.in_out_sine, loop=True)
-    Entity(update=lambda: glitch_start() if random.random() < 0.2 else None)
+    # Roughly the old one-in-five chance per frame, on a schedule
+    start_glitcher = Entity(name='start_glitcher')
+    start_glitcher.tick = lambda dt: glitch_start()
+    update_scheduler.add(start_glitcher, update_every(5))
     
     # Cryptic messages with more dread
-    messages = [
+    cryptic_messages = [
         'Every copy is personalized',
         'The AI is watching you',
         'You want fun? I’ll show you fun',
@@ -479,17 +2380,17 @@ def setup_b3313_menu():
         '⬛⬛⬛⬛⬛⬛⬛⬛'
     ]
     
-    message_text = Text(
-        random.choice(messages),
+    message_text = GlitchText(
+        cryptic_messages,
         position=(0, -0.5),
-        origin=(0, 0),
         scale=1,
         color=color.dark_gray
     )
+    message_text.text = random.choice(cryptic_messages)
     
     # Change message more frequently
     def change_message():
-        message_text.text = random.choice(messages)
+        message_text.text = random.choice(cryptic_messages)
         message_text.color = random.choice([color.dark_gray, color.red, color.black, color.green])
         message_text.scale = random.uniform(0.8, 1.2)
         invoke(change_message, delay=random.uniform(2, 6))
@@ -499,7 +2400,7 @@ def setup_b3313_menu():
     # Corrupted particles with more chaos
     for i in range(25):
         particle = Entity(
-            model=random.choice(['sphere', 'cube', 'cylinder']),
+            model=lod_models.get(random.choice(['sphere', 'cube', 'cylinder'])),
             color=random.choice([color.black, color.red, color.dark_gray, color.green]),
             scale=random.uniform(0.05, 0.2),
             position=(
@@ -513,6 +2414,7 @@ def setup_b3313_menu():
                         duration=random.uniform(1, 3), curve=curve.in_out_sine, loop=True)
         if random.random() < 0.3:
             particle.animate('scale', particle.scale * random.uniform(0.5, 1.5), duration=0.5, loop=True)
+        governor.add_decor(particle)
 
 # ----------- B3313 PLAYER CONTROLLER -----------
 class B3313PlayerController(Entity):
@@ -525,7 +2427,7 @@ class B3313PlayerController(Entity):
         
         # Player visual with occasional corruptions
         self.hat = Entity(model='cube', scale=(1.1, 0.4, 1.1), color=color.red, position=(0, 1.05, 0), parent=self)
-        self.head = Entity(model='sphere', scale=0.8, color=color.peach, position=(0, 0.6, 0), parent=self)
+        self.head = Entity(model=lod_models.get('sphere'), scale=0.8, color=color.peach, position=(0, 0.6, 0), parent=self)
         self.body = Entity(model='cube', scale=(1, 1, 1), color=color.blue, position=(0, -0.1, 0), parent=self)
         
         self.camera_pivot = Entity(parent=self, y=2)
@@ -533,7 +2435,8 @@ class B3313PlayerController(Entity):
         camera.position = (0, 2, -12)
         camera.rotation = (0, 0, 0)
         camera.fov = 90
-        mouse.locked = True
+        if application.window_type != 'none':
+            mouse.locked = True
 
         self.speed = 8
         self.jump_height = 8
@@ -544,6 +2447,7 @@ class B3313PlayerController(Entity):
         self.air_time = 0
         self.corruption_timer = 0
 
+    @frame_phase('player')
     def update(self):
         # B3313 random corruptions
         self.corruption_timer += time.dt
@@ -606,7 +2510,7 @@ class B3313PlayerController(Entity):
             self.position = (0, 10, -10)
             self.velocity_y = 0
             state['personalization_level'] += 1
-            print_on_screen("EVERY COPY IS PERSONALIZED", position=(0, 0), scale=3, duration=2, color=color.red)
+            messages.post("EVERY COPY IS PERSONALIZED", 'death', position=(0, 0), scale=3, duration=2, color=color.red)
 
     def apply_corruption(self):
         """Apply B3313 style player corruptions"""
@@ -635,236 +2539,1174 @@ class B3313PlayerController(Entity):
             self.velocity_y = self.jump_height
             self.jump_count += 1
             self.air_time = 0
-            try:
-                jump_sound.play()
-            except:
-                pass
+            audio.play('jump')
 
 # ----------- B3313 ENEMIES -----------
+def roll_goomba_variant(rng):
+    """Roll a goomba's type, colour and patrol; `rng` is the random module or a seeded Random"""
+    # Sometimes spawn as different enemy types
+    enemy_type = rng.choice(['goomba', 'dark_goomba', 'glitch'])
+    
+    colors = {
+        'goomba': tuple(color.brown),
+        'dark_goomba': tuple(color.black),
+        'glitch': (rng.randint(0,255) / 255, rng.randint(0,255) / 255, rng.randint(0,255) / 255, 1)
+    }
+    
+    return {
+        'enemy_type': enemy_type,
+        'color': colors[enemy_type],
+        'speed': rng.uniform(1, 4) if enemy_type == 'glitch' else 2,
+        'path_limit': rng.uniform(3, 8),
+    }
+
 class CorruptedGoomba(Entity):
-    def __init__(self, position=(0,0,0)):
-        # Sometimes spawn as different enemy types
-        self.enemy_type = random.choice(['goomba', 'dark_goomba', 'glitch'])
-        
-        colors = {
-            'goomba': color.brown,
-            'dark_goomba': color.black,
-            'glitch': color.rgb(random.randint(0,255), random.randint(0,255), random.randint(0,255))
-        }
+    def __init__(self, position=(0,0,0), variant=None, **kwargs):
+        variant = variant or roll_goomba_variant(random)
+        self.enemy_type = variant['enemy_type']
         
         super().__init__(
             name='goomba', 
             model='cube', 
-            color=colors[self.enemy_type], 
+            color=Vec4(*variant['color']), 
             scale=(1, 0.7, 1),
             position=position, 
             collider='box', 
-            shader=lit_with_shadows_shader
+            shader=lit_with_shadows_shader,
+            **kwargs
         )
         
-        Entity(model='sphere', color=color.dark_gray if self.enemy_type == 'dark_goomba' else color.peach, 
+        Entity(model=lod_models.get('sphere'), color=color.dark_gray if self.enemy_type == 'dark_goomba' else color.peach, 
                scale=(1.2, 0.5, 1.2), y=0.4, parent=self)
         
         self.direction = 1
-        self.speed = random.uniform(1, 4) if self.enemy_type == 'glitch' else 2
-        self.path_limit = random.uniform(3, 8)
+        self.speed = variant['speed']
+        self.path_limit = variant['path_limit']
         self.start_x = self.x
+        positional_audio.attach(self, 'goomba', room=kwargs.get('parent'))
+        shadows.add_caster(self)
+        update_scheduler.add(self, update_within())
+
+    @frame_phase('enemies')
+    def tick(self, dt):
+        self.x += self.direction * self.speed * dt
+        
+        if self.enemy_type == 'glitch' and random.random() < 0.01:
+            # Teleport randomly
+            self.position += Vec3(random.uniform(-2, 2), 0, random.uniform(-2, 2))
+        
+        if abs(self.x - self.start_x) > self.path_limit:
+            self.direction *= -1
+            self.rotation_y += 180
+
+class B3313ChainChomp(Entity):
+    def __init__(self, post_position=(0,0,0), is_chained=None, **kwargs):
+        post_position = Vec3(*post_position)
+        self.post = Entity(model=lod_models.get('cylinder'), position=post_position, scale=(1, 5, 1), 
+                          color=color.dark_gray, shader=lit_with_shadows_shader, **kwargs)
+        
+        # Sometimes spawn unchained
+        self.is_chained = random.random() > 0.2 if is_chained is None else is_chained
+        
+        super().__init__(
+            name='chain_chomp', 
+            model=lod_models.get('sphere'), 
+            color=color.black, 
+            scale=8, 
+            position=post_position + Vec3(-5, 4, 0), 
+            collider='sphere', 
+            shader=lit_with_shadows_shader,
+            **kwargs
+        )
+        
+        # Red eyes for B3313
+        Entity(model=lod_models.get('sphere'), color=color.red, scale=(0.3, 0.3, 0.3), 
+               position=(-0.3, 0.2, 0.4), parent=self)
+        Entity(model=lod_models.get('sphere'), color=color.red, scale=(0.3, 0.3, 0.3), 
+               position=(0.3, 0.2, 0.4), parent=self)
+        
+        self.chain_length = 20 if self.is_chained else float('inf')
+        self.state = 'idle'
+        self.lunge_speed = 40
+        self.retract_speed = 5
+        self.detection_radius = 30
+        positional_audio.attach(self, 'chain_chomp', room=kwargs.get('parent'))
+        shadows.add_caster(self)
+        shadows.add_caster(self.post)
+        update_scheduler.add(self, update_within())
+
+    @frame_phase('enemies')
+    def tick(self, dt):
+        dist_to_player = distance(self, player)
+        dist_to_post = distance(self, self.post)
+
+        if self.state == 'idle' and dist_to_player < self.detection_radius:
+            self.state = 'lunging'
+        
+        if self.state == 'lunging':
+            self.look_at(player)
+            self.position += self.forward * self.lunge_speed * dt
+            
+            if self.is_chained and dist_to_post > self.chain_length:
+                self.state = 'retracting'
+            elif not self.is_chained and dist_to_player > 50:
+                # Unchained chomps teleport back
+                self.position = self.post.position + Vec3(-5, 4, 0)
+                self.state = 'idle'
+        
+        if self.state == 'retracting':
+            target_pos = self.post.position + Vec3(0,4,0)
+            self.look_at(target_pos)
+            self.position = lerp(self.position, target_pos, min(1, dt * self.retract_speed))
+            if distance(self, target_pos) < 1:
+                self.state = 'idle'
+
+# ----------- B3313 LEVEL GENERATION -----------
+# Generation is split in two stages. generate_room_descriptor() rolls a room's layout
+# into plain picklable data and never touches the scene, so it can run in a process
+# pool ahead of time; room_build_steps() turns a descriptor into Entities on the render
+# thread, a small piece per step, so a door transition can spread it over frames.
+ROOM_SIZE = 40
+WALL_HEIGHT = 15
+ROOM_TYPES = ['normal', 'liminal', 'corrupted', 'endless']
+DOOR_DIRECTIONS = ['north', 'south', 'east', 'west']
+
+SolidSpec = namedtuple('SolidSpec', 'model position scale rotation color collider spin')
+LightSpec = namedtuple('LightSpec', 'position scale flicker')
+CoinSpec = namedtuple('CoinSpec', 'position color bob')
+SpawnSpec = namedtuple('SpawnSpec', 'kind position params')
+
+@dataclass
+class RoomDescriptor:
+    """A room's complete layout as plain data; colours are (r, g, b, a) tuples"""
+    seed: int
+    floor: int
+    personalization_level: int
+    room_type: str
+    has_ceiling: bool = True
+    solids: list = field(default_factory=list)
+    lights: list = field(default_factory=list)
+    props: list = field(default_factory=list)
+    spawns: list = field(default_factory=list)
+    doors: list = field(default_factory=list)
+    from_atlas: bool = False
+
+def roll_room_type(rng, floor, personalization_level):
+    if floor == 0:
+        return rng.choice(ROOM_TYPES)
+    # Create new room with increasing corruption
+    weights = [1, 2, 3 + personalization_level, 1 + personalization_level]
+    return rng.choices(ROOM_TYPES, weights=weights)[0]
+
+def generate_room_descriptor(seed, floor, personalization_level, room_type=None):
+    """Roll the layout of a room; the same inputs always give the same descriptor"""
+    rng = random.Random(seed)
+    if room_type is None:
+        room_type = roll_room_type(rng, floor, personalization_level)
+    desc = RoomDescriptor(seed, floor, personalization_level, room_type)
+    
+    # Ceiling (sometimes missing)
+    desc.has_ceiling = rng.random() > 0.3
+    
+    # Room-specific features
+    if desc.room_type == 'liminal':
+        generate_liminal_features(rng, desc)
+    elif desc.room_type == 'corrupted':
+        generate_corrupted_features(rng, desc)
+    elif desc.room_type == 'endless':
+        generate_endless_features(rng, desc)
+    
+    if floor == 0:
+        generate_entrance_entities(rng, desc)
+    else:
+        generate_room_entities(rng, desc)
+    
+    # Not all walls have doors
+    desc.doors = [d for d in DOOR_DIRECTIONS if rng.random() > 0.3]
+    return desc
+
+def generate_liminal_features(rng, desc):
+    """Add backrooms-like features"""
+    # Fluorescent lights
+    for i in range(3):
+        position = (rng.uniform(-15, 15), 14, rng.uniform(-15, 15))
+        desc.lights.append(LightSpec(position, (2, 0.2, 8), flicker=rng.random() < 0.3))
+    
+    # Random pillars
+    for i in range(rng.randint(2, 5)):
+        desc.solids.append(SolidSpec(
+            'cube', (rng.uniform(-15, 15), 7.5, rng.uniform(-15, 15)), (2, 15, 2), (0, 0, 0),
+            tuple(color.gray), collider=True, spin=0))
+
+def generate_corrupted_features(rng, desc):
+    """Add glitched/corrupted elements"""
+    # Floating geometry
+    for i in range(rng.randint(5, 10)):
+        model = rng.choice(['cube', 'sphere'])
+        scale = rng.uniform(1, 3)
+        position = (rng.uniform(-15, 15), rng.uniform(2, 12), rng.uniform(-15, 15))
+        random_color = (rng.random(), rng.random(), rng.random(), 1)
+        rotation = (rng.randint(0, 360), rng.randint(0, 360), rng.randint(0, 360))
+        desc.solids.append(SolidSpec(
+            model, position, (scale, scale, scale), rotation, random_color, collider=False, spin=rng.uniform(5, 15)))
+    
+    # Corrupted textures on walls
+    if rng.random() < 0.5:
+        x = rng.choice([-19.5, 19.5])
+        rotation = (0, 90 if rng.random() < 0.5 else -90, 0)
+        desc.solids.append(SolidSpec(
+            'plane', (x, 7, 0), (10, 1, 10), rotation, tuple(color.red), collider=False, spin=0))
+
+def generate_endless_features(rng, desc):
+    """Add endless hallway illusion"""
+    # Mirror-like walls
+    for z in range(-18, 19, 6):
+        desc.solids.append(SolidSpec(
+            'cube', (rng.choice([-10, 10]), 5, z), (0.5, 10, 0.5), (0, 0, 0),
+            tuple(color.dark_gray), collider=False, spin=0))
+
+def generate_entrance_entities(rng, desc):
+    """Spawn the entrance room's goombas, coins and hidden star"""
+    # Corrupted Goombas
+    for i in range(rng.randint(2, 5)):
+        position = (rng.uniform(-15, 15), 0.5, rng.uniform(-15, 15))
+        desc.spawns.append(SpawnSpec('goomba', position, roll_goomba_variant(rng)))
+    
+    # Coins (sometimes corrupted)
+    for i in range(rng.randint(5, 15)):
+        coin_color = tuple(color.gold if rng.random() > 0.2 else color.black)
+        position = (rng.uniform(-15, 15), 1, rng.uniform(-15, 15))
+        bob = rng.uniform(1, 3) if rng.random() < 0.3 else 0
+        desc.props.append(CoinSpec(position, coin_color, bob))
+    
+    # Hidden star (B3313 style)
+    star_positions = [
+        (15, 12, 15),    # High corner
+        (-18, 1, -18),   # Low corner
+        (0, -5, 0),      # Under the floor
+        (0, 20, 0),      # Above ceiling
+    ]
+    desc.spawns.append(SpawnSpec('star', rng.choice(star_positions), {
+        'model': 'star' if rng.random() > 0.3 else 'cube',
+        'color': tuple(color.yellow if rng.random() > 0.2 else color.black),
+        'enabled': rng.random() > 0.5,  # Sometimes invisible
+    }))
+
+def generate_room_entities(rng, desc):
+    """Spawn entities based on room type"""
+    if desc.room_type == 'corrupted':
+        # More enemies
+        for i in range(rng.randint(3, 8)):
+            position = (rng.uniform(-15, 15), 0.5, rng.uniform(-15, 15))
+            desc.spawns.append(SpawnSpec('goomba', position, roll_goomba_variant(rng)))
+        
+        # Unchained chomp chance
+        if rng.random() < 0.3:
+            desc.spawns.append(SpawnSpec('chomp', (0, 0, 0), {'is_chained': rng.random() > 0.2}))
+    
+    elif desc.room_type == 'liminal':
+        # Fewer enemies, more coins
+        for i in range(rng.randint(10, 20)):
+            position = (rng.uniform(-18, 18), 1, rng.uniform(-18, 18))
+            desc.props.append(CoinSpec(position, tuple(color.gold), 0))
+    
+    elif desc.room_type == 'endless':
+        # Repeating pattern of entities
+        for z in range(-15, 16, 5):
+            desc.props.append(CoinSpec((0, 1, z), tuple(color.gold if z % 2 == 0 else color.black), 0))
+    
+    # Random star placement
+    if rng.random() < 0.2:
+        position = (rng.uniform(-15, 15), rng.uniform(1, 10), rng.uniform(-15, 15))
+        desc.spawns.append(SpawnSpec('star', position, {
+            'model': 'star',
+            'color': tuple(color.yellow if rng.random() > 0.1 else color.black),
+            'enabled': True,
+        }))
+
+def validate_room_descriptor(desc):
+    """Return a list of problems with `desc`; an empty list means it is safe to instantiate"""
+    problems = []
+    half = ROOM_SIZE / 2
+    
+    def inside(position):
+        return abs(position[0]) <= half and abs(position[2]) <= half
+    
+    if desc.room_type not in ROOM_TYPES:
+        problems.append(f'unknown room type {desc.room_type!r}')
+    for solid in desc.solids:
+        if not inside(solid.position):
+            problems.append(f'{solid.model} outside the room at {solid.position}')
+    for light in desc.lights:
+        if not inside(light.position):
+            problems.append(f'light outside the room at {light.position}')
+    for coin in desc.props:
+        if not inside(coin.position):
+            problems.append(f'coin outside the room at {coin.position}')
+    for spawn in desc.spawns:
+        if spawn.kind not in ('goomba', 'chomp', 'star'):
+            problems.append(f'unknown spawn {spawn.kind!r}')
+        elif not inside(spawn.position):
+            problems.append(f'{spawn.kind} outside the room at {spawn.position}')
+    for direction in desc.doors:
+        if direction not in DOOR_DIRECTIONS:
+            problems.append(f'unknown door direction {direction!r}')
+    return problems
+
+def make_generation_pool(workers):
+    """Process pool for descriptor generation (spawned, so workers never inherit the GL context)"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def validate_rooms_in_bulk(count, workers=4, personalization_level=0):
+    """Generate `count` rooms in a process pool and report any invalid descriptors"""
+    seeds = [random.getrandbits(32) for i in range(count)]
+    floors = [i % 100 for i in range(count)]
+    levels = [personalization_level] * count
+    
+    failures = 0
+    type_counts = {t: 0 for t in ROOM_TYPES}
+    with make_generation_pool(workers) as pool:
+        for desc in pool.map(generate_room_descriptor, seeds, floors, levels, chunksize=256):
+            type_counts[desc.room_type] = type_counts.get(desc.room_type, 0) + 1
+            problems = validate_room_descriptor(desc)
+            if problems:
+                failures += 1
+                print(f"seed {desc.seed} floor {desc.floor}: {'; '.join(problems)}")
+    
+    print(f"Validated {count} rooms: {failures} invalid, types: {type_counts}")
+    return failures == 0
+
+class RoomPrefetcher:
+    """Generates descriptors for undiscovered neighbouring rooms in a process pool ahead of time"""
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.pool = None
+        self.pending = {}
+    
+    def submit(self, function, *args):
+        """Run `function(*args)` in the pool; returns the future, or None when the pool is unavailable"""
+        if not self.workers:
+            return None
+        if self.pool is None:
+            try:
+                self.pool = make_generation_pool(self.workers)
+            except (OSError, ValueError) as e:
+                print(f"Room prefetch disabled: {e}")
+                self.workers = 0
+                return None
+        return self.pool.submit(function, *args)
+    
+    def prefetch(self, coords, seed, floor, personalization_level):
+        if coords in self.pending:
+            return
+        future = self.submit(generate_room_descriptor, seed, floor, personalization_level)
+        if future is not None:
+            self.pending[coords] = future
+    
+    def take(self, coords):
+        """Return the prefetched descriptor for `coords` if it is ready, else None"""
+        future = self.pending.pop(coords, None)
+        if future is None or not future.done() or future.cancelled() or future.exception():
+            if future:
+                future.cancel()
+            return None
+        return future.result()
+    
+    def reset(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+    
+    def close(self):
+        """Cancel what is queued and wait for the workers, so nothing outlives the caller's folders"""
+        self.reset()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+room_prefetcher = RoomPrefetcher()
+
+# ----------- B3313 ROOM ATLAS -----------
+# Pregenerated rooms in a fixed-record binary file, memory-mapped on first use.
+# Header: magic, version, record size, type count, then (first record, count) per
+# room type. Records are grouped by room type, so a weighted pick is one type roll
+# plus one index into that type's range. Positions are stored in decimetres, scales,
+# spins and speeds in hundredths and colours as 8-bit RGBA.
+ROOM_ATLAS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'room_atlas.bin')
+ATLAS_MAGIC = b'B3AT'
+ATLAS_VERSION = 1
+ATLAS_MAX_SOLIDS = 12
+ATLAS_MAX_LIGHTS = 3
+ATLAS_MAX_COINS = 20
+ATLAS_MAX_SPAWNS = 10
+ATLAS_MODELS = ['cube', 'sphere', 'plane']
+ATLAS_SPAWN_KINDS = ['goomba', 'chomp', 'star']
+ATLAS_ENEMY_TYPES = ['goomba', 'dark_goomba', 'glitch']
+ATLAS_STAR_MODELS = ['star', 'cube']
+
+ATLAS_HEADER = struct.Struct('<4sHHHH')
+ATLAS_INDEX_ENTRY = struct.Struct('<II')
+ATLAS_ROOM = struct.Struct('<IBBBBBBBx')
+ATLAS_SOLID = struct.Struct('<BB3h3H3h4BH')
+ATLAS_LIGHT = struct.Struct('<3h3HBx')
+ATLAS_COIN = struct.Struct('<3h4BH')
+ATLAS_SPAWN = struct.Struct('<B3h4BBBHH')
+ATLAS_RECORD_SIZE = (ATLAS_ROOM.size + ATLAS_MAX_SOLIDS * ATLAS_SOLID.size + ATLAS_MAX_LIGHTS * ATLAS_LIGHT.size
+                     + ATLAS_MAX_COINS * ATLAS_COIN.size + ATLAS_MAX_SPAWNS * ATLAS_SPAWN.size)
+
+def _dm(position):
+    return tuple(round(v * 10) for v in position)
+
+def _rgba8(c):
+    return tuple(round(v * 255) for v in c)
+
+def pack_room_record(desc):
+    """Encode `desc` as one fixed-size atlas record"""
+    record = bytearray(ATLAS_RECORD_SIZE)
+    door_mask = sum(1 << i for i, d in enumerate(DOOR_DIRECTIONS) if d in desc.doors)
+    ATLAS_ROOM.pack_into(record, 0, desc.seed, ROOM_TYPES.index(desc.room_type), int(desc.has_ceiling), door_mask,
+                         len(desc.solids), len(desc.lights), len(desc.props), len(desc.spawns))
+    offset = ATLAS_ROOM.size
+    for i, s in enumerate(desc.solids):
+        ATLAS_SOLID.pack_into(record, offset + i * ATLAS_SOLID.size, ATLAS_MODELS.index(s.model), int(s.collider),
+                              *_dm(s.position), *(round(v * 100) for v in s.scale), *(round(v) for v in s.rotation),
+                              *_rgba8(s.color), round(s.spin * 100))
+    offset += ATLAS_MAX_SOLIDS * ATLAS_SOLID.size
+    for i, light in enumerate(desc.lights):
+        ATLAS_LIGHT.pack_into(record, offset + i * ATLAS_LIGHT.size, *_dm(light.position),
+                              *(round(v * 100) for v in light.scale), int(light.flicker))
+    offset += ATLAS_MAX_LIGHTS * ATLAS_LIGHT.size
+    for i, coin in enumerate(desc.props):
+        ATLAS_COIN.pack_into(record, offset + i * ATLAS_COIN.size, *_dm(coin.position), *_rgba8(coin.color),
+                             round(coin.bob * 100))
+    offset += ATLAS_MAX_COINS * ATLAS_COIN.size
+    for i, spawn in enumerate(desc.spawns):
+        p = spawn.params
+        if spawn.kind == 'goomba':
+            fields = (_rgba8(p['color']), ATLAS_ENEMY_TYPES.index(p['enemy_type']), 1,
+                      round(p['speed'] * 100), round(p['path_limit'] * 100))
+        elif spawn.kind == 'chomp':
+            fields = ((0, 0, 0, 0), int(p['is_chained']), 1, 0, 0)
+        else:
+            fields = (_rgba8(p['color']), ATLAS_STAR_MODELS.index(p['model']), int(p['enabled']), 0, 0)
+        rgba, a, b, c, d = fields
+        ATLAS_SPAWN.pack_into(record, offset + i * ATLAS_SPAWN.size, ATLAS_SPAWN_KINDS.index(spawn.kind),
+                              *_dm(spawn.position), *rgba, a, b, c, d)
+    return record
+
+def unpack_room_record(buffer, base, floor, personalization_level):
+    """Decode the atlas record at byte offset `base` into a RoomDescriptor"""
+    seed, type_index, flags, door_mask, n_solids, n_lights, n_coins, n_spawns = ATLAS_ROOM.unpack_from(buffer, base)
+    desc = RoomDescriptor(seed, floor, personalization_level, ROOM_TYPES[type_index], has_ceiling=bool(flags & 1),
+                          from_atlas=True)
+    desc.doors = [d for i, d in enumerate(DOOR_DIRECTIONS) if door_mask & (1 << i)]
+    
+    offset = base + ATLAS_ROOM.size
+    for i in range(n_solids):
+        v = ATLAS_SOLID.unpack_from(buffer, offset + i * ATLAS_SOLID.size)
+        desc.solids.append(SolidSpec(ATLAS_MODELS[v[0]], tuple(x / 10 for x in v[2:5]), tuple(x / 100 for x in v[5:8]),
+                                     v[8:11], tuple(x / 255 for x in v[11:15]), collider=bool(v[1]), spin=v[15] / 100))
+    offset = base + ATLAS_ROOM.size + ATLAS_MAX_SOLIDS * ATLAS_SOLID.size
+    for i in range(n_lights):
+        v = ATLAS_LIGHT.unpack_from(buffer, offset + i * ATLAS_LIGHT.size)
+        desc.lights.append(LightSpec(tuple(x / 10 for x in v[0:3]), tuple(x / 100 for x in v[3:6]), flicker=bool(v[6])))
+    offset += ATLAS_MAX_LIGHTS * ATLAS_LIGHT.size
+    for i in range(n_coins):
+        v = ATLAS_COIN.unpack_from(buffer, offset + i * ATLAS_COIN.size)
+        desc.props.append(CoinSpec(tuple(x / 10 for x in v[0:3]), tuple(x / 255 for x in v[3:7]), v[7] / 100))
+    offset += ATLAS_MAX_COINS * ATLAS_COIN.size
+    for i in range(n_spawns):
+        v = ATLAS_SPAWN.unpack_from(buffer, offset + i * ATLAS_SPAWN.size)
+        kind, position, rgba, a, b, c, d = ATLAS_SPAWN_KINDS[v[0]], tuple(x / 10 for x in v[1:4]), tuple(x / 255 for x in v[4:8]), *v[8:12]
+        if kind == 'goomba':
+            params = {'enemy_type': ATLAS_ENEMY_TYPES[a], 'color': rgba, 'speed': c / 100, 'path_limit': d / 100}
+        elif kind == 'chomp':
+            params = {'is_chained': bool(a)}
+        else:
+            params = {'model': ATLAS_STAR_MODELS[a], 'color': rgba, 'enabled': bool(b)}
+        desc.spawns.append(SpawnSpec(kind, position, params))
+    return desc
+
+def atlas_record_fits(desc):
+    return (len(desc.solids) <= ATLAS_MAX_SOLIDS and len(desc.lights) <= ATLAS_MAX_LIGHTS
+            and len(desc.props) <= ATLAS_MAX_COINS and len(desc.spawns) <= ATLAS_MAX_SPAWNS)
+
+def _generate_atlas_room(seed, room_type):
+    return generate_room_descriptor(seed, 1, 0, room_type=room_type)
+
+def build_room_atlas(path, count, workers=4):
+    """Generate `count` rooms (an even share per room type) into the atlas file at `path`"""
+    per_type = max(1, count // len(ROOM_TYPES))
+    room_types = [t for t in ROOM_TYPES for i in range(per_type)]
+    seeds = [random.getrandbits(32) for t in room_types]
+    
+    records = {t: [] for t in ROOM_TYPES}
+    skipped = 0
+    with make_generation_pool(workers) as pool:
+        for desc in pool.map(_generate_atlas_room, seeds, room_types, chunksize=256):
+            if validate_room_descriptor(desc) or not atlas_record_fits(desc):
+                skipped += 1
+                continue
+            records[desc.room_type].append(pack_room_record(desc))
+    
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(ATLAS_HEADER.pack(ATLAS_MAGIC, ATLAS_VERSION, ATLAS_RECORD_SIZE, len(ROOM_TYPES), 0))
+        first = 0
+        for t in ROOM_TYPES:
+            f.write(ATLAS_INDEX_ENTRY.pack(first, len(records[t])))
+            first += len(records[t])
+        for t in ROOM_TYPES:
+            for record in records[t]:
+                f.write(record)
+    os.replace(tmp_path, path)
+    
+    total = sum(len(r) for r in records.values())
+    print(f"Wrote {total} rooms ({ATLAS_RECORD_SIZE} bytes each, {skipped} skipped) to {path}")
+    return total
+
+class RoomAtlas:
+    """Memory-mapped pregenerated room layouts; the file is opened on first use, never parsed up front"""
+    def __init__(self, path=ROOM_ATLAS_PATH):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.ranges = {}
+        self.data_offset = 0
+        self.tried = False
+        self.stats = {'picks': 0}
+    
+    @property
+    def available(self):
+        if not self.tried:
+            self.tried = True
+            self.open()
+        return self.map is not None
+    
+    def open(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            self.file = open(self.path, 'rb')
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size, type_count, _ = ATLAS_HEADER.unpack_from(self.map, 0)
+            if magic != ATLAS_MAGIC or version != ATLAS_VERSION or record_size != ATLAS_RECORD_SIZE:
+                raise ValueError('atlas was built by a different version, rebuild it with --build-atlas')
+            for i, room_type in enumerate(ROOM_TYPES[:type_count]):
+                first, count = ATLAS_INDEX_ENTRY.unpack_from(self.map, ATLAS_HEADER.size + i * ATLAS_INDEX_ENTRY.size)
+                if count:
+                    self.ranges[room_type] = (first, count)
+            self.data_offset = ATLAS_HEADER.size + type_count * ATLAS_INDEX_ENTRY.size
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Room atlas unavailable: {e}")
+            self.close()
+    
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+        self.map = self.file = None
+        self.ranges = {}
+    
+    def pick(self, rng, room_type, floor, personalization_level):
+        """O(1) pick of a `room_type` layout, or None when the atlas has none of that type"""
+        if room_type not in self.ranges:
+            return None
+        first, count = self.ranges[room_type]
+        index = first + rng.randrange(count)
+        self.stats['picks'] += 1
+        return unpack_room_record(self.map, self.data_offset + index * ATLAS_RECORD_SIZE, floor, personalization_level)
+    
+    def descriptors(self):
+        """Every layout in the atlas, in file order"""
+        for first, count in self.ranges.values():
+            for index in range(first, first + count):
+                yield unpack_room_record(self.map, self.data_offset + index * ATLAS_RECORD_SIZE, 1, 0)
+
+room_atlas = RoomAtlas()
+
+def describe_room(seed, floor, personalization_level):
+    """Descriptor for a newly discovered room: an atlas record when one is available, else a fresh roll"""
+    if floor > 0 and room_atlas.available:
+        rng = random.Random(seed)
+        room_type = roll_room_type(rng, floor, personalization_level)
+        desc = room_atlas.pick(rng, room_type, floor, personalization_level)
+        if desc is not None:
+            return desc
+    return generate_room_descriptor(seed, floor, personalization_level)
+
+# ----------- B3313 LIGHTMAPS -----------
+# Static room lighting is baked instead of lit at runtime: sunlight through a missing
+# ceiling, the fluorescent panels and ambient occlusion in corners and around pillars
+# go into one small atlas per room layout, cached as a .png beside the baked geometry.
+# The room shell is then drawn unlit with that atlas as its only texture. Only layouts
+# that recur are baked (see lightmap_bakeable). Baking needs numpy; without it, or
+# until a room's bake is ready, rooms keep the flat baked shell.
+LIGHTMAP_DIR = os.path.join(CACHE_DIR, 'lightmaps')
+LIGHTMAP_VERSION = 1
+LIGHTMAP_SIZE = 256
+LIGHTMAP_AMBIENT = 0.25
+LIGHTMAP_SUN = (-0.4, -0.8, -0.45)  # direction the sunlight travels
+LIGHTMAP_SUN_STRENGTH = 0.8
+LIGHTMAP_PANEL_COLOR = (1.6, 1.5, 1.2)
+LIGHTMAP_PANEL_RANGE = 12
+LIGHTMAP_AO_STRENGTH = 0.45
+LIGHTMAP_AO_RADIUS = 1.5
+
+LightmapSurface = namedtuple('LightmapSurface', 'name tile origin u_axis v_axis normal')
+
+def lightmap_surfaces(has_ceiling):
+    """The inner faces of a room shell and their (x, y, width, height) tiles in the atlas"""
+    half, height = ROOM_SIZE / 2, WALL_HEIGHT
+    inner = half - 0.5
+    surfaces = [
+        LightmapSurface('floor', (0, 0, 128, 128), (-half, 0, -half), (ROOM_SIZE, 0, 0), (0, 0, ROOM_SIZE), (0, 1, 0)),
+        LightmapSurface('north', (0, 128, 128, 48), (-half, 0, inner), (ROOM_SIZE, 0, 0), (0, height, 0), (0, 0, -1)),
+        LightmapSurface('south', (128, 128, 128, 48), (-half, 0, -inner), (ROOM_SIZE, 0, 0), (0, height, 0), (0, 0, 1)),
+        LightmapSurface('east', (0, 176, 128, 48), (inner, 0, -half), (0, 0, ROOM_SIZE), (0, height, 0), (-1, 0, 0)),
+        LightmapSurface('west', (128, 176, 128, 48), (-inner, 0, -half), (0, 0, ROOM_SIZE), (0, height, 0), (1, 0, 0)),
+    ]
+    if has_ceiling:
+        surfaces.append(LightmapSurface('ceiling', (128, 0, 128, 128), (-half, height, -half), (ROOM_SIZE, 0, 0), (0, 0, ROOM_SIZE), (0, -1, 0)))
+    return surfaces
 
-    def update(self):
-        self.x += self.direction * self.speed * time.dt
-        
-        if self.enemy_type == 'glitch' and random.random() < 0.01:
-            # Teleport randomly
-            self.position += Vec3(random.uniform(-2, 2), 0, random.uniform(-2, 2))
-        
-        if abs(self.x - self.start_x) > self.path_limit:
-            self.direction *= -1
-            self.rotation_y += 180
+def lightmap_inputs(descriptor):
+    """Everything a room's lightmap depends on, as a hashable tuple"""
+    lights = tuple(tuple(light.position) for light in descriptor.lights)
+    # Unrotated static boxes (pillars, endless-hall posts) shadow and occlude
+    boxes = tuple(
+        (tuple(solid.position), tuple(size / 2 for size in solid.scale))
+        for solid in descriptor.solids
+        if solid.model == 'cube' and not solid.spin and not any(solid.rotation)
+    )
+    return (descriptor.room_type, descriptor.has_ceiling, lights, boxes)
 
-class B3313ChainChomp(Entity):
-    def __init__(self, post_position=(0,0,0)):
-        self.post = Entity(model='cylinder', position=post_position, scale=(1, 5, 1), 
-                          color=color.dark_gray, shader=lit_with_shadows_shader)
+def _segments_blocked(points, direction, length, box):
+    """Which of the segments points + t * direction, 0 < t < length, pass through `box`"""
+    center, half = np.array(box[0]), np.array(box[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse = 1 / direction
+        t1 = (center - half - points) * inverse
+        t2 = (center + half - points) * inverse
+    t_near = np.nanmax(np.minimum(t1, t2), axis=-1)
+    t_far = np.nanmin(np.maximum(t1, t2), axis=-1)
+    return (t_far >= np.maximum(t_near, 1e-3)) & (t_near < length)
+
+def bake_lightmap(inputs):
+    """Lit, occluded surface colours of one room layout as a (size, size, 3) uint8 image"""
+    room_type, has_ceiling, lights, boxes = inputs
+    half = ROOM_SIZE / 2
+    floor_color = color.white if room_type == 'normal' else color.dark_gray
+    wall_color = color.light_gray if room_type == 'normal' else color.black
+    floor_albedo = np.array((floor_color.r, floor_color.g, floor_color.b))
+    wall_albedo = np.array((wall_color.r, wall_color.g, wall_color.b))
+    to_sun = -np.array(LIGHTMAP_SUN) / np.linalg.norm(LIGHTMAP_SUN)
+    image = np.zeros((LIGHTMAP_SIZE, LIGHTMAP_SIZE, 3), dtype=np.float32)
+    
+    for surface in lightmap_surfaces(has_ceiling):
+        x0, y0, w, h = surface.tile
+        # Edge-inclusive samples, so the outermost texel centres sit on the surface edges
+        u, v = np.meshgrid(np.arange(w) / (w - 1), np.arange(h) / (h - 1))
+        points = (np.array(surface.origin) + u[..., None] * np.array(surface.u_axis)
+                  + v[..., None] * np.array(surface.v_axis))
+        normal = np.array(surface.normal)
+        light = np.full((h, w, 3), LIGHTMAP_AMBIENT, dtype=np.float32)
         
-        # Sometimes spawn unchained
-        self.is_chained = random.random() > 0.2
+        # Sun, only through the open top of the room
+        facing = max(0.0, float(normal @ to_sun))
+        if not has_ceiling and facing > 0:
+            t_top = (WALL_HEIGHT - points[..., 1]) / to_sun[1]
+            exit_point = points + t_top[..., None] * to_sun
+            lit = (np.abs(exit_point[..., 0]) <= half) & (np.abs(exit_point[..., 2]) <= half)
+            for box in boxes:
+                lit &= ~_segments_blocked(points, to_sun, t_top, box)
+            light += LIGHTMAP_SUN_STRENGTH * facing * lit[..., None]
         
-        super().__init__(
-            name='chain_chomp', 
-            model='sphere', 
-            color=color.black, 
-            scale=8, 
-            position=post_position + Vec3(-5, 4, 0), 
-            collider='sphere', 
-            shader=lit_with_shadows_shader
-        )
+        # Fluorescent panels
+        for position in lights:
+            offset = np.array(position) - points
+            dist = np.linalg.norm(offset, axis=-1)
+            direction = offset / dist[..., None]
+            strength = np.clip(direction @ normal, 0, None) / (1 + (dist / LIGHTMAP_PANEL_RANGE) ** 2)
+            for box in boxes:
+                strength *= ~_segments_blocked(points, direction, dist, box)
+            light += strength[..., None] * np.array(LIGHTMAP_PANEL_COLOR)
         
-        # Red eyes for B3313
-        Entity(model='sphere', color=color.red, scale=(0.3, 0.3, 0.3), 
-               position=(-0.3, 0.2, 0.4), parent=self)
-        Entity(model='sphere', color=color.red, scale=(0.3, 0.3, 0.3), 
-               position=(0.3, 0.2, 0.4), parent=self)
+        # Ambient occlusion from the neighbouring faces and the boxes
+        ao = np.ones((h, w), dtype=np.float32)
+        distances = [half - np.abs(points[..., 0]), half - np.abs(points[..., 2]), points[..., 1]]
+        if has_ceiling:
+            distances.append(WALL_HEIGHT - points[..., 1])
+        distances += [np.linalg.norm(np.maximum(np.abs(points - np.array(c)) - np.array(e), 0), axis=-1) for c, e in boxes]
+        for d in distances:
+            # A face's own plane (and the one facing it) is the same distance everywhere
+            if np.ptp(d) < 1e-3:
+                continue
+            ao *= 1 - LIGHTMAP_AO_STRENGTH * np.exp(-np.maximum(d, 0) / LIGHTMAP_AO_RADIUS)
         
-        self.chain_length = 20 if self.is_chained else float('inf')
-        self.state = 'idle'
-        self.lunge_speed = 40
-        self.retract_speed = 5
-        self.detection_radius = 30
+        albedo = np.broadcast_to(floor_albedo if surface.name == 'floor' else wall_albedo, (h, w, 3)).copy()
+        if surface.name == 'floor':
+            # The floor's white_cube tiling, 10 cells across
+            cell = ROOM_SIZE / 10
+            edge = np.abs((points[..., [0, 2]] / cell) % 1 - 0.5).max(axis=-1)
+            albedo *= np.where(edge > 0.46, 0.85, 1)[..., None]
+        image[y0:y0 + h, x0:x0 + w] = albedo * light * ao[..., None]
+    
+    return (np.clip(image, 0, 1) * 255 + 0.5).astype(np.uint8)
 
-    def update(self):
-        dist_to_player = distance(self, player)
-        dist_to_post = distance(self, self.post)
+def bake_lightmap_file(inputs, path):
+    """Bake one lightmap to `path`; runs in the room generation pool"""
+    pixels = bake_lightmap(inputs)
+    texture = PandaTexture('lightmap')
+    texture.setup_2d_texture(LIGHTMAP_SIZE, LIGHTMAP_SIZE, PandaTexture.T_unsigned_byte, PandaTexture.F_rgb)
+    texture.set_ram_image_as(pixels.tobytes(), 'RGB')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path[:-4] + '.tmp.png'
+    texture.write(Filename.from_os_specific(tmp_path))
+    os.replace(tmp_path, path)
+    return path
 
-        if self.state == 'idle' and dist_to_player < self.detection_radius:
-            self.state = 'lunging'
-        
-        if self.state == 'lunging':
-            self.look_at(player)
-            self.position += self.forward * self.lunge_speed * time.dt
-            
-            if self.is_chained and dist_to_post > self.chain_length:
-                self.state = 'retracting'
-            elif not self.is_chained and dist_to_player > 50:
-                # Unchained chomps teleport back
-                self.position = self.post.position + Vec3(-5, 4, 0)
-                self.state = 'idle'
-        
-        if self.state == 'retracting':
-            target_pos = self.post.position + Vec3(0,4,0)
-            self.look_at(target_pos)
-            self.position = lerp(self.position, target_pos, time.dt * self.retract_speed)
-            if distance(self, target_pos) < 1:
-                self.state = 'idle'
+def lightmap_shell_mesh(has_ceiling):
+    """Inward-facing quads for the room shell, UV-mapped onto their lightmap tiles"""
+    vertices, triangles, uvs = [], [], []
+    for surface in lightmap_surfaces(has_ceiling):
+        x0, y0, w, h = surface.tile
+        origin, u_axis, v_axis = Vec3(*surface.origin), Vec3(*surface.u_axis), Vec3(*surface.v_axis)
+        first = len(vertices)
+        for cu, cv in ((0, 0), (1, 0), (1, 1), (0, 1)):
+            vertices.append(origin + u_axis * cu + v_axis * cv)
+            # Corners land on the edge texel centres, so filtering never reads a neighbouring tile
+            uvs.append(((x0 + 0.5 + cu * (w - 1)) / LIGHTMAP_SIZE, (y0 + 0.5 + cv * (h - 1)) / LIGHTMAP_SIZE))
+        # Same winding as the procedural meshes: visible from the side the normal points to
+        a, b, c, d = first, first + 1, first + 2, first + 3
+        if u_axis.cross(v_axis).dot(Vec3(*surface.normal)) < 0:
+            triangles.extend(((a, b, c), (a, c, d)))
+        else:
+            triangles.extend(((a, c, b), (a, d, c)))
+    return Mesh(vertices=vertices, triangles=triangles, uvs=uvs)
+
+def lightmap_bakeable(descriptor):
+    """Whether a layout can recur: atlas records do, and so do rooms with no rolled lights or pillars.
+
+    A freshly rolled liminal or endless room places its lights and pillars at
+    random floats, so its lightmap would never be asked for again.
+    """
+    if descriptor.from_atlas:
+        return True
+    _, _, lights, boxes = lightmap_inputs(descriptor)
+    return not lights and not boxes
+
+class LightmapCache:
+    """Baked lightmaps on disk, keyed by their inputs and the bake code like the geometry cache.
+
+    A miss never bakes on the render thread: it queues the bake in the room
+    generation pool and the room uses its flat shell until its next build.
+    The folder holds at most `max_files` maps; hits refresh a file's mtime and
+    the oldest are evicted first.
+    """
+    max_files = 2048
+    
+    def __init__(self, folder=LIGHTMAP_DIR):
+        self.folder = folder
+        self.enabled = True
+        self.pending = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._fingerprint = None
+    
+    def path(self, inputs):
+        if self._fingerprint is None:
+            self._fingerprint = _source_fingerprint(bake_lightmap, lightmap_surfaces, _segments_blocked)
+        key = hashlib.sha1(f'{LIGHTMAP_VERSION}:{self._fingerprint}:{inputs!r}'.encode()).hexdigest()
+        return os.path.join(self.folder, key + '.png')
+    
+    def load(self, descriptor):
+        """The lightmap texture for `descriptor`, or None (and a background bake) when it isn't baked yet"""
+        if not self.enabled or np is None or not lightmap_bakeable(descriptor):
+            return None
+        self.collect()
+        inputs = lightmap_inputs(descriptor)
+        path = self.path(inputs)
+        if os.path.exists(path):
+            texture = loader.loadTexture(Filename.from_os_specific(path))
+            if texture:
+                self.stats['hits'] += 1
+                os.utime(path)
+                texture.set_minfilter(SamplerState.FT_linear)
+                texture.set_magfilter(SamplerState.FT_linear)
+                texture.set_wrap_u(SamplerState.WM_clamp)
+                texture.set_wrap_v(SamplerState.WM_clamp)
+                return texture
+        self.stats['misses'] += 1
+        if path not in self.pending:
+            future = room_prefetcher.submit(bake_lightmap_file, inputs, path)
+            if future is not None:
+                self.pending[path] = future
+        return None
+    
+    def collect(self):
+        """Forget finished bakes, and trim the folder when they added files"""
+        finished = [path for path, future in self.pending.items() if future.done()]
+        for path in finished:
+            del self.pending[path]
+        if finished:
+            self.trim()
+    
+    def trim(self):
+        try:
+            # Skip bakes still being written by a worker
+            names = [name for name in os.listdir(self.folder) if name.endswith('.png') and not name.endswith('.tmp.png')]
+            if len(names) <= self.max_files:
+                return
+            paths = sorted((os.path.join(self.folder, name) for name in names), key=os.path.getmtime)
+        except OSError:
+            return
+        for path in paths[:len(paths) - self.max_files]:
+            try:
+                os.remove(path)
+                self.stats['evictions'] += 1
+            except OSError:
+                pass
+
+lightmaps = LightmapCache()
+
+def bake_lightmaps_in_bulk(workers=4):
+    """Bake the lightmap of every layout in the room atlas that isn't cached yet"""
+    if np is None:
+        print('Lightmap baking needs numpy')
+        return 0
+    if not room_atlas.available:
+        print(f'No room atlas at {room_atlas.path}: build one with --build-atlas first')
+        return 0
+    started = time.perf_counter()
+    todo = {}
+    for desc in room_atlas.descriptors():
+        inputs = lightmap_inputs(desc)
+        path = lightmaps.path(inputs)
+        if not os.path.exists(path):
+            todo[path] = inputs
+    with make_generation_pool(workers) as pool:
+        for path in pool.map(bake_lightmap_file, todo.values(), todo.keys(), chunksize=4):
+            pass
+    print(f"Baked {len(todo)} lightmaps in {time.perf_counter() - started:.1f}s into {lightmaps.folder}")
+    return len(todo)
 
-# ----------- B3313 LEVEL GENERATION -----------
 class B3313Room(Entity):
-    def __init__(self, room_type='normal', position=(0,0,0)):
+    """An empty room; build_steps() fills it in from its descriptor a piece per step"""
+    def __init__(self, descriptor, position=(0,0,0)):
         super().__init__(position=position)
-        self.room_type = room_type
-        self.size = 40
-        
-        # Floor with different textures
-        floor_color = color.white if room_type == 'normal' else color.dark_gray
-        self.floor = Entity(
-            model='plane', 
-            scale=self.size, 
-            texture='white_cube',
-            texture_scale=(10, 10),
-            color=floor_color,
-            position=(0, 0, 0),
+        self.descriptor = descriptor
+        self.room_type = descriptor.room_type
+        self.size = ROOM_SIZE
+    
+    def build_steps(self):
+        descriptor = self.descriptor
+        # Floor, walls and ceiling: lightmapped when this layout has been baked, otherwise
+        # flat from the archetype cache. Invisible boxes do the collision either way
+        lightmap = lightmaps.load(descriptor)
+        if lightmap is not None:
+            self.shell = Entity(model=lightmap_shell_mesh(descriptor.has_ceiling), parent=self)
+            self.shell.set_texture(lightmap, 1)
+            self.shell.set_light_off(1)
+        else:
+            self.shell = Entity(
+                model=geometry_cache.load('room_shell', (self.room_type, descriptor.has_ceiling), bake_room_shell),
+                parent=self
+            )
+        yield
+        for position, scale in room_shell_colliders():
+            Entity(position=position, scale=scale, parent=self, collider='box')
+        yield
+        
+        # Static features are flattened into one node; spinning ones stay Entities
+        static_parts = []
+        for solid in descriptor.solids:
+            if solid.spin:
+                self.add_solid(solid)
+                yield
+                continue
+            static_parts.append(BakePart(solid.model, solid.position, solid.scale, solid.rotation, solid.color, None, None))
+            if solid.collider:
+                Entity(position=solid.position, scale=solid.scale, rotation=solid.rotation, parent=self, collider='box')
+        for light in descriptor.lights:
+            positional_audio.attach(self, 'fluorescent', offset=light.position, room=self)
+            if light.flicker:
+                self.add_light(light)
+                yield
+            else:
+                static_parts.append(BakePart('cube', light.position, light.scale, (0, 0, 0), tuple(color.yellow), None, None))
+        if static_parts:
+            self.features = Entity(model=bake_parts(static_parts), parent=self)
+            yield
+    
+    def add_solid(self, solid):
+        e = Entity(
+            model=lod_models.get(solid.model),
+            scale=solid.scale,
+            position=solid.position,
+            rotation=solid.rotation,
+            color=Vec4(*solid.color),
             parent=self,
-            collider='box'
+            collider='box' if solid.collider else None
         )
-        
-        # Walls
-        wall_height = 15
-        wall_color = color.light_gray if room_type == 'normal' else color.black
-        
-        # North wall
-        Entity(model='cube', scale=(self.size, wall_height, 1), 
-               position=(0, wall_height/2, self.size/2), 
-               color=wall_color, parent=self, collider='box')
-        
-        # South wall
-        Entity(model='cube', scale=(self.size, wall_height, 1), 
-               position=(0, wall_height/2, -self.size/2), 
-               color=wall_color, parent=self, collider='box')
-        
-        # East wall
-        Entity(model='cube', scale=(1, wall_height, self.size), 
-               position=(self.size/2, wall_height/2, 0), 
-               color=wall_color, parent=self, collider='box')
-        
-        # West wall
-        Entity(model='cube', scale=(1, wall_height, self.size), 
-               position=(-self.size/2, wall_height/2, 0), 
-               color=wall_color, parent=self, collider='box')
-        
-        # Ceiling (sometimes missing)
-        if random.random() > 0.3:
-            Entity(model='plane', scale=self.size, rotation=(180, 0, 0),
-                   position=(0, wall_height, 0), color=wall_color, parent=self)
-        
-        # Room-specific features
-        if room_type == 'liminal':
-            self.add_liminal_features()
-        elif room_type == 'corrupted':
-            self.add_corrupted_features()
-        elif room_type == 'endless':
-            self.add_endless_features()
-    
-    def add_liminal_features(self):
-        """Add backrooms-like features"""
-        # Fluorescent lights
-        for i in range(3):
-            light = Entity(
-                model='cube',
-                scale=(2, 0.2, 8),
-                position=(random.uniform(-15, 15), 14, random.uniform(-15, 15)),
-                color=color.yellow,
-                parent=self
+        if solid.spin:
+            e.animate('rotation', Vec3(360, 360, 360), duration=solid.spin, loop=True)
+    
+    def add_light(self, spec):
+        """Fluorescent light panel, flickering"""
+        light = Entity(
+            model='cube',
+            scale=spec.scale,
+            position=spec.position,
+            color=color.yellow,
+            parent=self
+        )
+        # Flickering effect
+        def flicker():
+            # Stop once the room has been evicted, or the chain outlives it
+            if light.is_empty():
+                return
+            light.enabled = not light.enabled
+            invoke(flicker, delay=random.uniform(0.1, 0.5))
+        flicker()
+
+def spawn_room_steps(room):
+    """Instantiate the goombas, chomps, coins and stars from the room's descriptor, one per step"""
+    for coin_spec in room.descriptor.props:
+        coin = Entity(
+            name='coin',
+            model=lod_models.get('cylinder'),
+            color=Vec4(*coin_spec.color),
+            scale=0.5,
+            position=coin_spec.position,
+            rotation=(90, 0, 0),
+            parent=room
+        )
+        if coin_spec.bob:
+            coin.animate('y', coin.y + coin_spec.bob, duration=2, curve=curve.in_out_sine, loop=True)
+        yield
+    
+    for spawn in room.descriptor.spawns:
+        if spawn.kind == 'goomba':
+            CorruptedGoomba(position=spawn.position, variant=spawn.params, parent=room)
+        elif spawn.kind == 'chomp':
+            B3313ChainChomp(post_position=spawn.position, is_chained=spawn.params['is_chained'], parent=room)
+        elif spawn.kind == 'star':
+            star = Entity(
+                name='star',
+                model=spawn.params['model'],
+                color=Vec4(*spawn.params['color']),
+                scale=3,
+                position=spawn.position,
+                rotation_y=45,
+                enabled=spawn.params['enabled'],
+                shader=lit_with_shadows_shader,
+                parent=room
             )
-            # Flickering effect
-            if random.random() < 0.3:
-                def flicker():
-                    light.enabled = not light.enabled
-                    invoke(flicker, delay=random.uniform(0.1, 0.5))
-                flicker()
-        
-        # Random pillars
-        for i in range(random.randint(2, 5)):
-            Entity(
+            star.animate('rotation_y', 360, duration=5, loop=True)
+            shadows.add_caster(star)
+        yield
+
+def create_doors(room, required=()):
+    """Create mysterious doors that lead to other rooms; `required` doors always exist.
+
+    Directions that already have a door are skipped, so calling it again on a
+    cached room only adds the doors to neighbours discovered since it was built.
+    """
+    door_positions = [
+        (0, 2.5, 19.5, 'north'),
+        (0, 2.5, -19.5, 'south'),
+        (19.5, 2.5, 0, 'east'),
+        (-19.5, 2.5, 0, 'west')
+    ]
+    
+    existing = {e.direction for e in room.children if e.name == 'door'}
+    for x, y, z, direction in door_positions:
+        if direction in existing:
+            continue
+        if direction in room.descriptor.doors or direction in required:
+            door = Entity(
+                name='door',
                 model='cube',
-                scale=(2, 15, 2),
-                position=(random.uniform(-15, 15), 7.5, random.uniform(-15, 15)),
-                color=color.gray,
-                parent=self,
-                collider='box'
+                scale=(5, 5, 0.5) if direction in ['north', 'south'] else (0.5, 5, 5),
+                position=(x, y, z),
+                color=color.black,
+                collider='box',
+                parent=room
             )
+            door.direction = direction
+            positional_audio.attach(door, 'door', room=room)
+
+def room_build_steps(descriptor, required_doors=()):
+    """Build a room from its descriptor a small piece per step (render thread only); returns the room.
+
+    The room stays detached while it fills in, so nothing in it is drawn, collides
+    or updates; doors go in last and collision comes on with the final step.
+    """
+    room = B3313Room(descriptor, position=(0, 0, 0))
+    set_room_active(room, False)
+    yield
+    yield from room.build_steps()
+    yield from spawn_room_steps(room)
+    create_doors(room, required=required_doors)
+    yield
+    set_room_active(room, True)
+    return room
+
+def run_steps(steps):
+    """Run a step generator to the end in one go and return its result"""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+def instantiate_room(descriptor, required_doors=()):
+    """Turn a descriptor into a fully built room in one go"""
+    return run_steps(room_build_steps(descriptor, required_doors))
+
+# ----------- B3313 CASTLE GRAPH -----------
+DIRECTION_OFFSETS = {
+    'north': (0, 1),
+    'south': (0, -1),
+    'east': (1, 0),
+    'west': (-1, 0),
+}
+OPPOSITE_DIRECTIONS = {'north': 'south', 'south': 'north', 'east': 'west', 'west': 'east'}
+
+class RoomNode:
+    """One room of the castle: a stable id, grid coordinates and the descriptor rolled for it"""
+    def __init__(self, node_id, coords, seed, descriptor):
+        self.node_id = node_id
+        self.coords = coords
+        self.seed = seed
+        self.descriptor = descriptor
     
-    def add_corrupted_features(self):
-        """Add glitched/corrupted elements"""
-        # Floating geometry
-        for i in range(random.randint(5, 10)):
-            Entity(
-                model=random.choice(['cube', 'sphere']),
-                scale=random.uniform(1, 3),
-                position=(random.uniform(-15, 15), random.uniform(2, 12), random.uniform(-15, 15)),
-                color=color.random_color(),
-                rotation=(random.randint(0, 360), random.randint(0, 360), random.randint(0, 360)),
-                parent=self
-            ).animate('rotation', Vec3(360, 360, 360), duration=random.uniform(5, 15), loop=True)
+    @property
+    def room_type(self):
+        return self.descriptor.room_type
+
+class CastleGraph:
+    """Persistent map of every room discovered this run, keyed by grid coordinates"""
+    def __init__(self, seed=None):
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.nodes = {}
+    
+    def node_seed(self, coords):
+        x, z = coords
+        return (self.seed * 2654435761 ^ x * 73856093 ^ z * 19349663) & 0xFFFFFFFF
+    
+    def node_at(self, coords, floor=0):
+        """Return the room at `coords`, rolling its layout the first time it is discovered"""
+        node = self.nodes.get(coords)
+        if node is None:
+            seed = self.node_seed(coords)
+            descriptor = room_prefetcher.take(coords)
+            if descriptor is None:
+                descriptor = describe_room(seed, floor, state['personalization_level'])
+            node = RoomNode(len(self.nodes), coords, seed, descriptor)
+            self.nodes[coords] = node
+        return node
+    
+    def neighbour_coords(self, node, direction):
+        dx, dz = DIRECTION_OFFSETS[direction]
+        return (node.coords[0] + dx, node.coords[1] + dz)
+    
+    def neighbour(self, node, direction, floor=0):
+        return self.node_at(self.neighbour_coords(node, direction), floor)
+    
+    def known_directions(self, node):
+        """Directions from `node` that lead to rooms already on the map"""
+        return [d for d in DIRECTION_OFFSETS if self.neighbour_coords(node, d) in self.nodes]
+    
+    def prefetch_neighbours(self, node, floor):
+        """Queue descriptor generation for the undiscovered rooms behind `node`'s doors"""
+        if room_atlas.available:
+            return
+        for direction in node.descriptor.doors:
+            coords = self.neighbour_coords(node, direction)
+            if coords not in self.nodes:
+                room_prefetcher.prefetch(coords, self.node_seed(coords), floor, state['personalization_level'])
+
+def room_descendants(entity):
+    for child in entity.children:
+        yield child
+        yield from room_descendants(child)
+
+def set_room_active(room, active):
+    """Attach or detach a built room: hide it, stop its updates, colliders and animations"""
+    room.enabled = active
+    for e in room_descendants(room):
+        e.ignore = not active
+        if e.collider:
+            e.collision = active
+        for animation in getattr(e, 'animations', []):
+            if active:
+                animation.resume()
+            else:
+                animation.pause()
+
+class RoomCache:
+    """LRU of detached, fully built rooms so backtracking is a re-attach instead of a rebuild"""
+    def __init__(self, max_rooms=8, max_entities=2000):
+        self.max_rooms = max_rooms
+        self.max_entities = max_entities
+        self.rooms = OrderedDict()
+        self.entity_counts = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    @property
+    def entity_total(self):
+        return sum(self.entity_counts.values())
+    
+    def store(self, node_id, room):
+        """Detach `room` and keep it, evicting the least recently used rooms while over the cap"""
+        set_room_active(room, False)
+        self.rooms[node_id] = room
+        self.rooms.move_to_end(node_id)
+        self.entity_counts[node_id] = sum(1 for _ in room_descendants(room)) + 1
         
-        # Corrupted textures on walls
-        if random.random() < 0.5:
-            Entity(
-                model='plane',
-                scale=(10, 10),
-                position=(random.choice([-19.5, 19.5]), 7, 0),
-                rotation=(0, 90 if random.random() < 0.5 else -90, 0),
-                color=color.red,
-                parent=self
-            )
+        while self.rooms and (len(self.rooms) > self.max_rooms or self.entity_total > self.max_entities):
+            evicted_id, evicted = self.rooms.popitem(last=False)
+            del self.entity_counts[evicted_id]
+            destroy_entity(evicted)
+            self.stats['evictions'] += 1
     
-    def add_endless_features(self):
-        """Add endless hallway illusion"""
-        # Mirror-like walls
-        for z in range(-18, 19, 6):
-            Entity(
-                model='cube',
-                scale=(0.5, 10, 0.5),
-                position=(random.choice([-10, 10]), 5, z),
-                color=color.dark_gray,
-                parent=self
-            )
+    def take(self, node_id):
+        """Re-attach and return the cached room for `node_id`, or None if it has to be built"""
+        room = self.rooms.pop(node_id, None)
+        if room is None:
+            self.stats['misses'] += 1
+            return None
+        del self.entity_counts[node_id]
+        self.stats['hits'] += 1
+        set_room_active(room, True)
+        return room
+    
+    def reset(self):
+        """Forget cached rooms (the scene clear has already destroyed them)"""
+        self.rooms.clear()
+        self.entity_counts.clear()
+
+castle = CastleGraph()
+room_cache = RoomCache()
+
+def build_room_steps(node):
+    """Instantiate `node`'s descriptor step by step, so a room rebuilt after eviction looks the same"""
+    room = yield from room_build_steps(node.descriptor, required_doors=castle.known_directions(node))
+    room.castle_node = node
+    return room
+
+def build_room(node):
+    return run_steps(build_room_steps(node))
 
 def setup_b3313_level():
-    global player, ground, current_room
+    global player, ground, current_room, castle
     
     # Clear existing entities
-    for e in scene.entities:
-        if e not in [camera, mouse, window.fps_counter, window.exit_button]:
-            destroy(e)
+    for e in scene.entities[:]:
+        if e not in [camera, mouse] and not e.eternal:
+            destroy_entity(e)
 
     # Reset state
     state['coins'] = 0
@@ -872,7 +3714,19 @@ def setup_b3313_level():
     state['king_bobomb_throws'] = 0
     state['is_holding_king'] = False
     state['current_floor'] = 0
-    state['rooms_visited'] = []
+    state['rooms_visited'] = deque(maxlen=state['rooms_visited'].maxlen)
+    room_transition.reset()
+    room_cache.reset()
+    tweens.reset()
+    messages.reset()
+    positional_audio.reset()
+    fog_culling.reset()
+    update_scheduler.reset()
+    lod_models.reset()
+    governor.reset()
+    shadows.reset()
+    room_prefetcher.reset()
+    castle = CastleGraph()
     
     # Enable fog for atmosphere
     scene.fog_color = color.rgb(20, 20, 20)
@@ -882,53 +3736,12 @@ def setup_b3313_level():
     player = B3313PlayerController(position=(0, 5, 0), color=color.clear)
     
     # Ambient sound
-    try:
-        ambient_hum.play()
-    except:
-        pass
+    ambience.enter('game')
     
     # Generate initial room
-    room_types = ['normal', 'liminal', 'corrupted', 'endless']
-    current_room = B3313Room(room_type=random.choice(room_types), position=(0, 0, 0))
-    state['rooms_visited'].append(current_room.position)
-    
-    # Add some initial entities
-    # Corrupted Goombas
-    for i in range(random.randint(2, 5)):
-        CorruptedGoomba(position=(random.uniform(-15, 15), 0.5, random.uniform(-15, 15)))
-    
-    # Coins (sometimes corrupted)
-    for i in range(random.randint(5, 15)):
-        coin = Entity(
-            name='coin', 
-            model='cylinder', 
-            color=color.gold if random.random() > 0.2 else color.black, 
-            scale=0.5, 
-            position=(random.uniform(-15, 15), 1, random.uniform(-15, 15)), 
-            rotation=(90, 0, 0)
-        )
-        if random.random() < 0.3:
-            coin.animate('y', coin.y + random.uniform(1, 3), duration=2, curve=curve.in_out_sine, loop=True)
-    
-    # Hidden star (B3313 style)
-    star_positions = [
-        (15, 12, 15),    # High corner
-        (-18, 1, -18),   # Low corner
-        (0, -5, 0),      # Under the floor
-        (0, 20, 0),      # Above ceiling
-    ]
-    
-    star = Entity(
-        name='star', 
-        model='star' if random.random() > 0.3 else 'cube', 
-        color=color.yellow if random.random() > 0.2 else color.black, 
-        scale=3, 
-        position=random.choice(star_positions), 
-        rotation_y=45, 
-        enabled=random.random() > 0.5,  # Sometimes invisible
-        shader=lit_with_shadows_shader
-    )
-    star.animate('rotation_y', 360, duration=5, loop=True)
+    current_room = build_room(castle.node_at((0, 0)))
+    state['rooms_visited'].append(current_room.castle_node.node_id)
+    castle.prefetch_neighbours(current_room.castle_node, floor=1)
     
     # UI with corruption
     coin_text = Text(
@@ -958,32 +3771,20 @@ def setup_b3313_level():
         name='personalization_text',
         color=color.red
     )
-    
-    # Add door portals
-    create_doors()
 
-def create_doors():
-    """Create mysterious doors that lead to other rooms"""
-    door_positions = [
-        (0, 2.5, 19.5, 'north'),
-        (0, 2.5, -19.5, 'south'),
-        (19.5, 2.5, 0, 'east'),
-        (-19.5, 2.5, 0, 'west')
-    ]
-    
-    for x, y, z, direction in door_positions:
-        if random.random() > 0.3:  # Not all walls have doors
-            door = Entity(
-                name='door',
-                model='cube',
-                scale=(5, 5, 0.5) if direction in ['north', 'south'] else (0.5, 5, 5),
-                position=(x, y, z),
-                color=color.black,
-                collider='box'
-            )
-            door.direction = direction
+def set_hud_text(name, text):
+    """scene.find returns a bare NodePath (and never sees camera.ui), so look the Text up by entity"""
+    for e in scene.entities:
+        if e.name == name:
+            e.text = text
+            return
+
+def room_entities(name):
+    """Entities called `name` in the current room"""
+    return [e for e in room_descendants(current_room) if e.name == name]
 
 # ----------- MAIN GAME LOOP FOR B3313 -----------
+@frame_phase('update')
 def update():
     if state['game_mode'] == 'splash':
         return
@@ -994,28 +3795,36 @@ def update():
     if 'player' not in globals():
         return
     
+    shadows.update(player)
+    check_doors()
+    check_enemy_contacts()
+    collect_coins()
+    collect_stars()
+    update_corruption()
+
+@frame_phase('update:doors')
+def check_doors():
     # Check for door transitions
     hit_info = player.intersects()
     if hit_info.hit and hasattr(hit_info.entity, 'name') and hit_info.entity.name == 'door':
         # Transition to new room
         transition_room(hit_info.entity.direction)
-    
+
+@frame_phase('update:enemy contacts')
+def check_enemy_contacts():
     # Enemy interactions
     hit_info = player.intersects()
     if hit_info.hit and hasattr(hit_info.entity, 'name'):
         # Stomp Logic
         if player.velocity_y < -1 and player.y > hit_info.entity.y + 0.5 and player.air_time > 0.1:
             if hit_info.entity.name == 'goomba':
-                try:
-                    stomp_sound.play()
-                except:
-                    pass
-                destroy(hit_info.entity)
+                audio.play('stomp')
+                destroy_entity(hit_info.entity)
                 player.velocity_y = 5
                 
                 # Sometimes spawn more enemies
                 if random.random() < 0.3:
-                    CorruptedGoomba(position=hit_info.entity.position + Vec3(random.uniform(-5, 5), 0, random.uniform(-5, 5)))
+                    CorruptedGoomba(position=hit_info.entity.position + Vec3(random.uniform(-5, 5), 0, random.uniform(-5, 5)), parent=current_room)
         
         # Damage
         elif hit_info.entity.name in ['goomba', 'chain_chomp']:
@@ -1025,68 +3834,75 @@ def update():
             
             # Corruption effect
             camera.shake(duration=0.5, magnitude=5)
-            print_on_screen(random.choice(['OUCH', 'ERROR', '???', '⬛⬛⬛']), 
+            messages.post(random.choice(['OUCH', 'ERROR', '???', '⬛⬛⬛']), 'damage',
                           position=(random.uniform(-0.3, 0.3), random.uniform(-0.3, 0.3)), 
                           scale=4, duration=1, color=color.red)
 
+@frame_phase('update:coins')
+def collect_coins():
     # Coin Collection with corruption
     hit_info = player.intersects()
     if hit_info.hit and hasattr(hit_info.entity, 'name') and hit_info.entity.name == 'coin':
-        try:
-            coin_sound.play()
-        except:
-            pass
+        audio.play('coin')
         
         # Sometimes coins are cursed
         if hit_info.entity.color == color.black:
             state['coins'] = max(0, state['coins'] - 1)
-            print_on_screen("CURSED", position=(0, 0.2), scale=2, duration=1, color=color.red)
+            messages.post("CURSED", 'cursed', position=(0, 0.2), scale=2, duration=1, color=color.red)
         else:
             state['coins'] += 1
         
-        destroy(hit_info.entity)
-        scene.find('coin_text').text = f"Coins: {state['coins']}"
+        destroy_entity(hit_info.entity)
+        set_hud_text('coin_text', f"Coins: {state['coins']}")
         
         # Random coin duplication in B3313 style
         if random.random() < 0.1:
             for i in range(random.randint(2, 5)):
                 Entity(
                     name='coin',
-                    model='cylinder',
+                    model=lod_models.get('cylinder'),
                     color=color.gold if random.random() > 0.3 else color.black,
                     scale=0.5,
                     position=hit_info.entity.position + Vec3(random.uniform(-2, 2), 0, random.uniform(-2, 2)),
-                    rotation=(90, 0, 0)
+                    rotation=(90, 0, 0),
+                    parent=current_room
                 )
 
+@frame_phase('update:stars')
+def collect_stars():
     # Star Collection
-    star = scene.find('star')
-    if star and star.enabled and distance(player, star) < 4:
-        try:
-            star_sound.play()
-        except:
-            pass
-        destroy(star)
+    for star in room_entities('star'):
+        if not star.enabled or distance(player, star) >= 4:
+            continue
+        audio.play('star')
+        destroy_entity(star)
         state['stars'] += 1
-        scene.find('star_text').text = f"Stars: {state['stars']}"
+        set_hud_text('star_text', f"Stars: {state['stars']}")
         
         # B3313 star message
-        messages = [
+        star_messages = [
             "YOU GOT A STAR!",
             "ANOTHER SOUL COLLECTED",
             "THE PERSONALIZATION CONTINUES",
             f"STAR #{state['stars']}... BUT AT WHAT COST?",
             "⭐⭐⭐⭐⭐"
         ]
-        print_on_screen(random.choice(messages), position=(0, 0), scale=5, duration=3, color=color.yellow)
+        messages.post(random.choice(star_messages), 'star', position=(0, 0), scale=5, duration=3, color=color.yellow)
         
         # Sometimes warp player
         if random.random() < 0.3:
             player.position = Vec3(random.uniform(-15, 15), 5, random.uniform(-15, 15))
-            print_on_screen("WHERE AM I?", position=(0, -0.2), scale=3, duration=2, color=color.red)
+            messages.post("WHERE AM I?", 'warp', position=(0, -0.2), scale=3, duration=2, color=color.red)
+        break
+
+@frame_phase('update:corruption')
+def update_corruption():
+    # Ambience layers follow the personalization level
+    ambience.follow(state['personalization_level'])
     
-    # Update personalization text
-    if scene.find('personalization_text'):
+    # Update personalization text. Headless there is no camera.ui, so the HUD lands under scene
+    # as a bare NodePath; skip it there as the windowed game does.
+    if application.window_type != 'none' and scene.find('personalization_text'):
         scene.find('personalization_text').text = f"P.LVL: {state['personalization_level']}"
         
         # Increase corruption with personalization
@@ -1099,123 +3915,197 @@ def update():
                 camera.fov = random.randint(60, 120)
                 invoke(setattr, camera, 'fov', 90, delay=0.5)
 
-def transition_room(direction):
-    """Transition to a new B3313 room"""
-    global current_room
-    
-    # Fade effect
-    fade = Entity(model='cube', scale=100, color=color.black, alpha=0)
-    fade.animate('alpha', 1, duration=0.3)
-    
-    def create_new_room():
-        # Destroy old room
-        destroy(current_room)
-        
-        # Create new room with increasing corruption
-        room_types = ['normal', 'liminal', 'corrupted', 'endless']
-        weights = [1, 2, 3 + state['personalization_level'], 1 + state['personalization_level']]
-        
-        room_type = random.choices(room_types, weights=weights)[0]
-        current_room = B3313Room(room_type=room_type, position=(0, 0, 0))
-        
-        # Move player to opposite side
-        positions = {
-            'north': (0, 5, -18),
-            'south': (0, 5, 18),
-            'east': (-18, 5, 0),
-            'west': (18, 5, 0)
+# ----------- B3313 ROOM TRANSITIONS -----------
+class RoomTransition:
+    """Door transition state machine: idle -> fading_out -> building -> fading_in -> idle.
+
+    Door contacts that arrive while a transition is in flight are ignored, so one
+    touch builds exactly one room no matter how long the player overlaps the door.
+    While the screen is black the new room is built from a step generator, as many
+    steps per frame as fit in `build_budget` seconds (always at least one).
+    """
+    fade_duration = 0.3
+    build_budget = 0.004
+
+    def __init__(self):
+        self.phase = 'idle'
+        self.direction = None
+        self.fade = None
+        self.serial = 0
+        self.started_at = 0
+        self.steps = None
+        self.builder = None
+        self.build_time = 0.0
+        self.build_frames = 0
+        self.metrics = {
+            'transitions': 0,
+            'ignored_triggers': 0,
+            'last_latency': 0.0,
+            'max_latency': 0.0,
+            'total_latency': 0.0,
+            'last_build_time': 0.0,
+            'max_build_time': 0.0,
+            'last_build_frames': 0,
+            'max_step_time': 0.0,
         }
-        player.position = positions[direction]
+
+    @property
+    def busy(self):
+        return self.phase != 'idle'
+
+    @property
+    def average_latency(self):
+        if not self.metrics['transitions']:
+            return 0.0
+        return self.metrics['total_latency'] / self.metrics['transitions']
+
+    def request(self, direction):
+        """Start a transition through the door facing `direction`; returns False if one is in flight"""
+        if self.busy:
+            self.metrics['ignored_triggers'] += 1
+            return False
         
-        # Spawn new entities
-        spawn_room_entities(room_type)
+        self.serial += 1
+        self.phase = 'fading_out'
+        self.direction = direction
+        self.started_at = time.perf_counter()
         
-        # Create new doors
-        create_doors()
+        # Fade effect
+        self.fade = Entity(model='cube', scale=100, color=color.black, alpha=0)
+        self.fade.animate('alpha', 1, duration=self.fade_duration)
+        invoke(self._build, self.serial, delay=self.fade_duration)
+        return True
+
+    def reset(self):
+        """Forget any in-flight transition (the scene it was fading has been cleared)"""
+        self.serial += 1
+        self.phase = 'idle'
+        self.direction = None
+        self.fade = None
+        self.steps = None
+        if self.builder is not None and not self.builder.is_empty():
+            destroy_entity(self.builder)
+        self.builder = None
+
+    def _build(self, serial):
+        if serial != self.serial:
+            return
+        self.phase = 'building'
+        self.steps = create_new_room(self.direction)
+        self.build_time = 0.0
+        self.build_frames = 0
+        self.builder = Entity(name='room_builder', update=self._step)
+    
+    @frame_phase('room build')
+    def _step(self):
+        frame_start = time.perf_counter()
+        self.build_frames += 1
+        while True:
+            step_start = time.perf_counter()
+            try:
+                next(self.steps)
+                finished = False
+            except StopIteration:
+                finished = True
+            now = time.perf_counter()
+            self.metrics['max_step_time'] = max(self.metrics['max_step_time'], now - step_start)
+            if finished or now - frame_start >= self.build_budget:
+                break
+        self.build_time += now - frame_start
+        if finished:
+            self._built()
+    
+    def _built(self):
+        self.metrics['last_build_time'] = self.build_time
+        self.metrics['max_build_time'] = max(self.metrics['max_build_time'], self.build_time)
+        self.metrics['last_build_frames'] = self.build_frames
+        destroy_entity(self.builder)
+        self.builder = self.steps = None
         
         # Fade back
-        fade.animate('alpha', 0, duration=0.3)
-        destroy(fade, delay=0.4)
-        
-        state['current_floor'] += 1
-        
-        # Creepy messages
-        if state['current_floor'] % 5 == 0:
-            messages = [
-                f"FLOOR -{state['current_floor']}",
-                "DEEPER AND DEEPER",
-                "NO ESCAPE",
-                "THE CASTLE REMEMBERS",
-                "YOU'VE BEEN HERE BEFORE"
-            ]
-            print_on_screen(random.choice(messages), position=(0, 0.3), scale=3, duration=3, color=color.red)
-    
-    invoke(create_new_room, delay=0.3)
+        self.phase = 'fading_in'
+        self.fade.animate('alpha', 0, duration=self.fade_duration)
+        invoke(self._finish, self.serial, delay=self.fade_duration + 0.1)
 
-def spawn_room_entities(room_type):
-    """Spawn entities based on room type"""
-    if room_type == 'corrupted':
-        # More enemies
-        for i in range(random.randint(3, 8)):
-            CorruptedGoomba(position=(random.uniform(-15, 15), 0.5, random.uniform(-15, 15)))
-        
-        # Unchained chomp chance
-        if random.random() < 0.3:
-            B3313ChainChomp(post_position=(0, 0, 0))
+    def _finish(self, serial):
+        if serial != self.serial:
+            return
+        destroy_entity(self.fade)
+        latency = time.perf_counter() - self.started_at
+        self.metrics['transitions'] += 1
+        self.metrics['last_latency'] = latency
+        self.metrics['max_latency'] = max(self.metrics['max_latency'], latency)
+        self.metrics['total_latency'] += latency
+        self.reset()
+
+room_transition = RoomTransition()
+
+def transition_room(direction):
+    """Transition to a new B3313 room"""
+    return room_transition.request(direction)
+
+def create_new_room(direction):
+    """Swap the current room for the one behind the door at `direction`, as build steps for RoomTransition"""
+    global current_room
     
-    elif room_type == 'liminal':
-        # Fewer enemies, more coins
-        for i in range(random.randint(10, 20)):
-            Entity(
-                name='coin',
-                model='cylinder',
-                color=color.gold,
-                scale=0.5,
-                position=(random.uniform(-18, 18), 1, random.uniform(-18, 18)),
-                rotation=(90, 0, 0)
-            )
+    state['current_floor'] += 1
+    # Hold the player still while neither room has collision
+    player.ignore = True
     
-    elif room_type == 'endless':
-        # Repeating pattern of entities
-        for z in range(-15, 16, 5):
-            Entity(
-                name='coin',
-                model='cylinder',
-                color=color.gold if z % 2 == 0 else color.black,
-                scale=0.5,
-                position=(0, 1, z),
-                rotation=(90, 0, 0)
-            )
+    # Park the old room so walking back through this door is a re-attach
+    next_node = castle.neighbour(current_room.castle_node, direction, floor=state['current_floor'])
+    room_cache.store(current_room.castle_node.node_id, current_room)
+    yield
     
-    # Random star placement
-    if random.random() < 0.2:
-        star = Entity(
-            name='star',
-            model='star',
-            color=color.yellow if random.random() > 0.1 else color.black,
-            scale=3,
-            position=(random.uniform(-15, 15), random.uniform(1, 10), random.uniform(-15, 15)),
-            rotation_y=45,
-            shader=lit_with_shadows_shader
-        )
-        star.animate('rotation_y', 360, duration=5, loop=True)
+    room = room_cache.take(next_node.node_id)
+    if room is None:
+        room = yield from build_room_steps(next_node)
+    else:
+        # Rooms found while this one was parked need their doors back here too
+        create_doors(room, required=castle.known_directions(next_node))
+    current_room = room
+    player.ignore = False
+    
+    # Move player to opposite side
+    positions = {
+        'north': (0, 5, -18),
+        'south': (0, 5, 18),
+        'east': (-18, 5, 0),
+        'west': (18, 5, 0)
+    }
+    player.position = positions[direction]
+    
+    state['rooms_visited'].append(next_node.node_id)
+    castle.prefetch_neighbours(next_node, floor=state['current_floor'] + 1)
+    
+    # Creepy messages
+    if state['current_floor'] % 5 == 0:
+        floor_messages = [
+            f"FLOOR -{state['current_floor']}",
+            "DEEPER AND DEEPER",
+            "NO ESCAPE",
+            "THE CASTLE REMEMBERS",
+            "YOU'VE BEEN HERE BEFORE"
+        ]
+        messages.post(random.choice(floor_messages), 'floor', position=(0, 0.3), scale=3, duration=3, color=color.red)
 
 def input(key):
     global mario_head
     
+    # Profiler works in every mode, so splash and menu can be recorded too
+    if key == 'f9':
+        profiler.toggle()
+    
     if state['game_mode'] == 'splash':
         # Skip splash
         if key in ['space', 'enter', 'escape']:
+            preloader.skip_warmup()
             state['game_mode'] = 'menu'
             setup_b3313_menu()
     
     elif state['game_mode'] == 'menu':
         if key in ['space', 'enter']:
             state['game_mode'] = 'game'
-            try:
-                menu_hum.stop()
-            except:
-                pass
             setup_b3313_level()
         elif key == 'escape':
             application.quit()
@@ -1235,17 +4125,222 @@ def input(key):
         
         if key == 'f':
             window.fullscreen = not window.fullscreen
+        
+        if key == 'h':
+            frame_watchdog.dump()
+        
+        if key == 't':
+            m = room_transition.metrics
+            print(f"Transitions: {m['transitions']} (ignored triggers: {m['ignored_triggers']}) "
+                  f"latency avg/max: {room_transition.average_latency:.3f}/{m['max_latency']:.3f}s "
+                  f"build last/max: {m['last_build_time']:.3f}/{m['max_build_time']:.3f}s "
+                  f"over {m['last_build_frames']} frames, longest step {m['max_step_time'] * 1000:.1f}ms")
+            c = room_cache.stats
+            print(f"Room cache: {len(room_cache.rooms)}/{room_cache.max_rooms} rooms, "
+                  f"{room_cache.entity_total}/{room_cache.max_entities} entities, "
+                  f"hits: {c['hits']} misses: {c['misses']} evictions: {c['evictions']}, "
+                  f"castle rooms discovered: {len(castle.nodes)}")
 
-# ----------- INITIALIZE B3313 -----------
-# Dark sky for B3313
-sky = Sky(color=color.rgb(10, 10, 10))
+# ----------- B3313 SOAK TEST -----------
+# --soak N walks N door transitions headless and watches for anything that grows
+# with the floor count: process memory, Python allocations, live Entities,
+# scene-graph nodes and pending invokes. Growth is the trend of a sample every
+# SOAK_SAMPLE_EVERY floors, reported per 100 floors, and the run fails when it
+# passes the limits below.
+SOAK_SAMPLE_EVERY = 10
+SOAK_REPORT_EVERY = 100
+SOAK_WARMUP = 200  # floors before the baseline: the room cache and pools fill up first
+SOAK_LIMITS = {'rss_mb': 4.0, 'python_mb': 2.0, 'entities': 20, 'nodes': 100, 'invokes': 10,
+               'lightmap_mb': 1.0, 'pending_bakes': 5}
+
+SoakSample = namedtuple('SoakSample', 'floors rss_mb python_mb entities nodes invokes lightmap_mb pending_bakes castle_rooms')
+
+def resident_mb():
+    """Current resident set size; falls back to the peak where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def folder_mb(folder):
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file()) / 2 ** 20
+    except OSError:
+        return 0.0
+
+def soak_sample():
+    # Cycles waiting for the next collection aren't growth
+    gc.collect()
+    return SoakSample(
+        room_transition.metrics['transitions'],
+        resident_mb(),
+        tracemalloc.get_traced_memory()[0] / 2 ** 20,
+        len(scene.entities),
+        render.count_num_descendants(),
+        pstats_export.pending_invokes,
+        folder_mb(lightmaps.folder),
+        len(lightmaps.pending),
+        len(castle.nodes),
+    )
+
+def growth_per_floor(samples, measure):
+    """Least-squares slope of `measure` over `samples`"""
+    xs = [sample.floors for sample in samples]
+    ys = [getattr(sample, measure) for sample in samples]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+def run_soak_test(transitions, seed=0):
+    """Run `transitions` door transitions with no window; returns whether growth stayed under SOAK_LIMITS"""
+    # Lightmap bakes go to a scratch folder, so their growth is measured without filling the real cache
+    with tempfile.TemporaryDirectory(prefix='b3313_soak_') as scratch:
+        lightmaps.folder = os.path.join(scratch, 'lightmaps')
+        try:
+            return soak_transitions(transitions, seed, scratch)
+        finally:
+            room_prefetcher.close()
 
-# Dim lighting for atmosphere
-DirectionalLight(y=50, z=50, x=50, shadows=True, shadow_map_resolution=(2048,2048), color=color.rgb(200, 200, 200))
-AmbientLight(color=color.rgb(50, 50, 50))
+def soak_transitions(transitions, seed, scratch):
+    rng = random.Random(seed)
+    tracemalloc.start(25)
+    audio.null = True
+    room_transition.fade_duration = 0
+    state['game_mode'] = 'game'
+    setup_b3313_level()
+    # The soak picks doors itself; with no input the controller would only fall and collide
+    player.disable()
+    
+    baseline = baseline_snapshot = None
+    samples = []
+    print(f"{'floors':>7} {'rss MB':>8} {'py MB':>7} {'entities':>9} {'nodes':>7} {'invokes':>8} "
+          f"{'lm MB':>7} {'bakes':>6} {'rooms':>6}")
+    while room_transition.metrics['transitions'] < transitions:
+        if not room_transition.busy:
+            done = room_transition.metrics['transitions']
+            if done % SOAK_SAMPLE_EVERY == 0 and (not samples or samples[-1].floors != done):
+                sample = soak_sample()
+                samples.append(sample)
+                if done % SOAK_REPORT_EVERY == 0:
+                    print(f"{sample.floors:>7} {sample.rss_mb:>8.1f} {sample.python_mb:>7.2f} {sample.entities:>9} "
+                          f"{sample.nodes:>7} {sample.invokes:>8} {sample.lightmap_mb:>7.2f} {sample.pending_bakes:>6} "
+                          f"{sample.castle_rooms:>6}")
+                if done >= SOAK_WARMUP and baseline is None:
+                    # Parked on disk: held in memory, the snapshot itself would show up as RSS growth
+                    baseline, baseline_snapshot = sample, os.path.join(scratch, 'baseline.tracemalloc')
+                    tracemalloc.take_snapshot().dump(baseline_snapshot)
+            doors = [e.direction for e in room_descendants(current_room) if e.name == 'door']
+            room_transition.request(rng.choice(doors or DOOR_DIRECTIONS))
+        base.taskMgr.step()
+    
+    final = soak_sample()
+    if samples[-1].floors != final.floors:
+        samples.append(final)
+    trend = [sample for sample in samples if baseline is not None and sample.floors >= baseline.floors]
+    if len(trend) < 2:
+        print(f"Soak too short to measure growth: needs more than {SOAK_WARMUP} transitions")
+        return True
+    print(f"\nGrowth per 100 floors after a {baseline.floors}-floor warm-up, over {len(trend)} samples:")
+    passed = True
+    for measure, limit in SOAK_LIMITS.items():
+        growth = growth_per_floor(trend, measure) * 100
+        ok = growth <= limit
+        passed &= ok
+        print(f"  {measure:>10}: {growth:+10.2f} (limit {limit}){'' if ok else '  FAIL'}")
+    print(f"  castle map: {final.castle_rooms} rooms, rooms_visited: {len(state['rooms_visited'])}")
+    
+    print("\nTop allocation sites since the baseline:")
+    for stat in tracemalloc.take_snapshot().compare_to(tracemalloc.Snapshot.load(baseline_snapshot), 'lineno')[:10]:
+        print(f"  {stat}")
+    print(f"\nSoak {'passed' if passed else 'FAILED'}")
+    return passed
 
-# Start with splash screen
-show_splash_screen()
+# ----------- INITIALIZE B3313 -----------
+def parse_args():
+    parser = argparse.ArgumentParser(description='B3313 1.0 - SPECIAL 64 EMULATOR')
+    parser.add_argument('--validate-rooms', type=int, metavar='COUNT',
+                        help='generate COUNT rooms in a process pool, validate them and exit')
+    parser.add_argument('--build-atlas', type=int, metavar='COUNT',
+                        help='pregenerate COUNT room layouts into the room atlas and exit')
+    parser.add_argument('--atlas', default=ROOM_ATLAS_PATH, help='room atlas file')
+    parser.add_argument('--prewarm-cache', action='store_true', help='bake every cached archetype and exit')
+    parser.add_argument('--bake-lightmaps', action='store_true', help='bake lightmaps for every room in the atlas and exit')
+    parser.add_argument('--no-geometry-cache', action='store_true', help='bake geometry in memory only')
+    parser.add_argument('--quality', default='auto', choices=['auto'] + [tier.name for tier in QUALITY_TIERS],
+                        help='pin a quality tier instead of adapting to the frame rate')
+    parser.add_argument('--no-audio', action='store_true', help='play every sound through a silent backend')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes for offline generation')
+    parser.add_argument('--hitch-ms', type=float, default=FrameWatchdog.threshold * 1000, metavar='MS',
+                        help='log frames longer than this to the hitch buffer')
+    parser.add_argument('--pstats', nargs='?', const='localhost', metavar='HOST[:PORT]',
+                        help='send game-logic collectors to a PStats server (default localhost)')
+    parser.add_argument('--soak', type=int, metavar='TRANSITIONS',
+                        help='walk this many door transitions headless, report leaks and exit')
+    parser.add_argument('--lod-hysteresis', type=float, default=LodModels.hysteresis, metavar='FRACTION',
+                        help='how far past a switch distance a shape must go before changing LOD (0: plain LODNode)')
+    parser.add_argument('--build-budget', type=float, default=RoomTransition.build_budget * 1000, metavar='MS',
+                        help='milliseconds per frame spent building a room during a door transition')
+    # Leave anything else for ursina/panda3d
+    args, unknown = parser.parse_known_args()
+    return args
 
-# Run the cursed game
-app.run()
+if __name__ == '__main__':
+    args = parse_args()
+    
+    if args.validate_rooms:
+        sys.exit(0 if validate_rooms_in_bulk(args.validate_rooms, workers=args.workers) else 1)
+    if args.build_atlas:
+        build_room_atlas(args.atlas, args.build_atlas, workers=args.workers)
+        sys.exit()
+    room_atlas.path = args.atlas
+    geometry_cache.enabled = not args.no_geometry_cache
+    room_transition.build_budget = args.build_budget / 1000
+    lod_models.hysteresis = args.lod_hysteresis
+    frame_watchdog.threshold = args.hitch_ms / 1000
+    lightmaps.enabled = not args.no_geometry_cache
+    
+    if args.bake_lightmaps:
+        bake_lightmaps_in_bulk(workers=args.workers)
+        sys.exit()
+    
+    if args.prewarm_cache:
+        app = Ursina(window_type='none')
+        prewarm_geometry_cache()
+        sys.exit()
+    if args.soak:
+        app = Ursina(window_type='none')
+        sys.exit(0 if run_soak_test(args.soak) else 1)
+    
+    enable_driver_shader_cache()
+    app = Ursina()
+    setup_window()
+    frame_watchdog.start()
+    if args.pstats:
+        pstats_export.connect(args.pstats)
+    # Sounds are preloaded behind the splash; the ambience streams from disk
+    audio.null = args.no_audio
+    
+    # Dark sky for B3313
+    # Sky and lights are eternal, so the scene clears in the menu and level setups keep them
+    sky = Sky(color=color.rgb(10, 10, 10), eternal=True)
+    # A fog-culled far plane can pull in to a few dozen units, so the sky must never hide the room
+    sky.set_bin('background', 0)
+    sky.set_depth_write(False)
+    sky.set_depth_test(False)
+    governor.sky = sky
+    
+    # Dim lighting for atmosphere
+    sun = DirectionalLight(y=50, z=50, x=50, shadows=True, shadow_map_resolution=(2048,2048), color=color.rgb(200, 200, 200), eternal=True)
+    governor.sun = sun
+    shadows.attach(sun)
+    if args.quality != 'auto':
+        governor.pin(args.quality)
+    AmbientLight(color=color.rgb(50, 50, 50), eternal=True)
+    
+    # Start with splash screen
+    show_splash_screen()
+    
+    # Run the cursed game
+    app.run()